@@ -12,6 +12,7 @@ from pages._reports import ReportsPage
 from pages.multi_image_registration import MultiImageRegistrationPage
 from database.db_manager import DatabaseManager
 from utils.helpers import get_system_info, StreamlitUtils
+from utils.resources import get_db_manager
 
 # Configure page
 st.set_page_config(
@@ -145,7 +146,7 @@ def show_main_app(auth):
         # Quick stats
         st.markdown("### 📈 Quick Stats")
         try:
-            db_manager = DatabaseManager()
+            db_manager = get_db_manager()
             
             # Get stats
             total_users = len(db_manager.get_all_users())
@@ -187,7 +188,7 @@ def show_dashboard():
     st.subheader("🏠 Dashboard")
     
     try:
-        db_manager = DatabaseManager()
+        db_manager = get_db_manager()
         
         # Get dashboard metrics
         all_users = db_manager.get_all_users()
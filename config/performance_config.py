@@ -9,6 +9,8 @@ FACE_DETECTION_CONFIG = {
     'frame_scale_factor': 0.5,  # Scale down frames for faster processing
     'skip_frames': 3,  # Process every 3rd frame
     'cache_timeout': 2.0,  # Cache results for 2 seconds
+    'opencv_threads': 4,  # Upper bound for OpenCV's internal thread pool
+    'use_opencl': False,  # Run frame downscaling through cv2.UMat (OpenCL) when available
     
     # Face detection model settings
     'hog_upsamples': 0,  # Reduce upsampling for faster detection
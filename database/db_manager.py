@@ -74,6 +74,9 @@ class DatabaseManager:
             )
         ''')
         
+        # Index attendance by date for day and date-range lookups
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_att_date ON attendance(date)')
+        
         # Create attendance log table for detailed logs
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS attendance_logs (
@@ -303,8 +306,8 @@ class DatabaseManager:
         conn.close()
         return True
     
-    def get_attendance_records(self, date=None, user_id=None):
-        """Get attendance records"""
+    def get_attendance_records(self, date=None, user_id=None, start_date=None, end_date=None):
+        """Get attendance records, optionally limited to an inclusive date range"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
@@ -325,6 +328,14 @@ class DatabaseManager:
             query += " AND a.user_id = ?"
             params.append(user_id)
         
+        if start_date:
+            query += " AND a.date >= ?"
+            params.append(start_date.isoformat())
+        
+        if end_date:
+            query += " AND a.date <= ?"
+            params.append(end_date.isoformat())
+        
         query += " ORDER BY a.date DESC, a.check_in_time DESC"
         
         cursor.execute(query, params)
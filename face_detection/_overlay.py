@@ -0,0 +1,65 @@
+"""
+Preview Overlay Kernels
+
+Drawing helpers for the per-frame preview overlays: glyph-free box and
+bar fills done with NumPy slicing, and cached text sprites.
+"""
+
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+def draw_box_and_bar(img, top, right, bottom, left, color, thickness=2, bar_height=6):
+    """
+    Draw a face box outline and a status bar along the top edge in place
+    Args:
+        img: BGR uint8 frame, modified in place
+        top, right, bottom, left: Face box; a negative top skips the box
+        color: (b, g, r) status color used for both box and bar
+        thickness: Box outline thickness in pixels
+        bar_height: Status bar height in pixels
+    """
+    h, w = img.shape[:2]
+    
+    img[:bar_height, :] = color
+    
+    if top < 0:
+        return
+    
+    # Clip the box to the frame
+    top = min(max(top, 0), h - 1)
+    bottom = min(max(bottom, 0), h - 1)
+    left = min(max(left, 0), w - 1)
+    right = min(max(right, 0), w - 1)
+    
+    img[top:top + thickness, left:right + 1] = color
+    img[max(bottom - thickness + 1, 0):bottom + 1, left:right + 1] = color
+    img[top:bottom + 1, left:left + thickness] = color
+    img[top:bottom + 1, max(right - thickness + 1, 0):right + 1] = color
+
+@lru_cache(maxsize=64)
+def render_text_sprite(text, color, font_scale=0.6, thickness=2):
+    """Rasterize text once into a small BGR sprite plus its glyph mask"""
+    (text_width, text_height), baseline = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, font_scale, thickness)
+    pad = thickness
+    sprite = np.zeros((text_height + baseline + 2 * pad, text_width + 2 * pad, 3), dtype=np.uint8)
+    cv2.putText(sprite, text, (pad, text_height + pad), cv2.FONT_HERSHEY_SIMPLEX, font_scale, color, thickness)
+    mask = sprite.any(axis=2)
+    return sprite, mask, text_height + pad, pad
+
+def blit_text(frame, text, origin, color):
+    """Composite a cached text sprite onto frame with origin as in cv2.putText"""
+    sprite, mask, ascent, pad = render_text_sprite(text, color)
+    x, y = origin[0] - pad, origin[1] - ascent
+    
+    # Clip the sprite to the frame bounds
+    frame_height, frame_width = frame.shape[:2]
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + sprite.shape[1], frame_width), min(y + sprite.shape[0], frame_height)
+    if x0 >= x1 or y0 >= y1:
+        return
+    
+    sprite_region = sprite[y0 - y:y1 - y, x0 - x:x1 - x]
+    mask_region = mask[y0 - y:y1 - y, x0 - x:x1 - x]
+    frame[y0:y1, x0:x1][mask_region] = sprite_region[mask_region]
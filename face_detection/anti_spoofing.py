@@ -80,9 +80,11 @@ class AntiSpoofing:
         except Exception as e:
             return 0.3  # Return default "open" value on error
     
-    def detect_blink(self, frame) -> Tuple[bool, int, np.ndarray]:
+    def detect_blink(self, frame, draw: bool = True) -> Tuple[bool, int, np.ndarray]:
         """
         Detect eye blinks in the frame with improved sensitivity
+        Args:
+            draw: Annotate the frame with eye landmarks, EAR and blink count
         Returns: (is_blinking, total_blinks, processed_frame)
         """
         rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
@@ -119,6 +121,9 @@ class AntiSpoofing:
                     self.eye_state = "open"
                     self.blink_counter = 0
                 
+                if not draw:
+                    continue
+                
                 # Draw eye landmarks for visualization
                 self._draw_eye_landmarks(frame, face_landmarks)
                 
@@ -128,8 +133,9 @@ class AntiSpoofing:
                            (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.6, status_color, 2)
         
         # Add blink counter
-        cv2.putText(frame, f"Blinks Detected: {self.total_blinks}", (10, 60),
-                   cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 255), 2)
+        if draw:
+            cv2.putText(frame, f"Blinks Detected: {self.total_blinks}", (10, 60),
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 255), 2)
         
         return is_blinking, self.total_blinks, frame
     
@@ -192,17 +198,37 @@ class LivenessDetector:
         self.start_time = time.time()
         self.anti_spoofing.reset_blink_detection()
     
-    def process_frame(self, frame) -> Tuple[bool, bool, str, np.ndarray]:
+    def process_frame(self, frame, draw: bool = True) -> Tuple[bool, bool, str, np.ndarray]:
         """
         Process frame for liveness detection with improved feedback
+        Args:
+            draw: Annotate the frame; callers that show status_message themselves can skip it
         Returns: (is_live, detection_complete, status_message, processed_frame)
         """
         if self.start_time is None:
             self.start_detection()
         
         # Detect blinks
-        is_blinking, total_blinks, processed_frame = self.anti_spoofing.detect_blink(frame)
+        is_blinking, total_blinks, processed_frame = self.anti_spoofing.detect_blink(frame, draw)
+        
+        return self._evaluate_liveness(is_blinking, total_blinks, processed_frame, draw)
+    
+    def process_frame_with_boxes(self, frame, boxes) -> Tuple[bool, bool, str, np.ndarray]:
+        """
+        Process frame using face boxes from an upstream detector; the face mesh
+        is skipped entirely when no face was found
+        Returns: (is_live, detection_complete, status_message, processed_frame)
+        """
+        if boxes:
+            return self.process_frame(frame)
+        
+        if self.start_time is None:
+            self.start_detection()
         
+        return self._evaluate_liveness(False, self.anti_spoofing.total_blinks, frame)
+    
+    def _evaluate_liveness(self, is_blinking, total_blinks, processed_frame, draw=True) -> Tuple[bool, bool, str, np.ndarray]:
+        """Turn blink results into the liveness verdict and annotate the frame"""
         # Calculate elapsed time
         elapsed_time = time.time() - self.start_time
         remaining_time = max(0, self.detection_duration - elapsed_time)
@@ -231,8 +257,9 @@ class LivenessDetector:
                 status_message = f"❌ Liveness check failed - please blink naturally. Blinks: {total_blinks}"
         
         # Add status to frame with better visibility
-        cv2.putText(processed_frame, status_message, (10, 90),
-                   cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 2)
+        if draw:
+            cv2.putText(processed_frame, status_message, (10, 90),
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 2)
         
         return is_live, detection_complete, status_message, processed_frame
     
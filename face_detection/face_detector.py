@@ -7,6 +7,12 @@ from typing import List, Tuple, Optional, Dict, Any
 import time
 from concurrent.futures import ThreadPoolExecutor
 import threading
+from config.performance_config import FACE_DETECTION_CONFIG
+
+# Let OpenCV parallelize resize/color conversion and enable the T-API if requested
+cv2.setNumThreads(min(FACE_DETECTION_CONFIG['opencv_threads'], os.cpu_count() or 1))
+USE_OPENCL = FACE_DETECTION_CONFIG['use_opencl'] and cv2.ocl.haveOpenCL()
+cv2.ocl.setUseOpenCL(USE_OPENCL)
 
 class FaceDetector:
     def __init__(self):
@@ -23,6 +29,9 @@ class FaceDetector:
         self.num_jitters = 5  # Number of times to re-sample for encoding
         self.tolerance = 0.5  # Face matching tolerance (lower = stricter)
         
+        # Downscale through OpenCL (cv2.UMat) when enabled in the config
+        self.use_opencl = USE_OPENCL
+        
         # Thread pool for parallel processing
         self.executor = ThreadPoolExecutor(max_workers=2)
         
@@ -30,15 +39,18 @@ class FaceDetector:
         self.detection_cache = {}
         self.cache_timeout = 2.0  # seconds
         
+        # One detector is shared by every webrtc session, guard the cache and known faces
+        self._lock = threading.Lock()
+        
     def load_known_faces(self, face_data: List[Dict[str, Any]]):
         """
         Load known faces from database with support for multiple encodings per person
         Args:
             face_data: List of dictionaries with 'id', 'name', 'employee_id', 'encodings'
         """
-        self.known_face_encodings = []
-        self.known_face_names = []
-        self.known_face_ids = []
+        known_encodings = []
+        known_names = []
+        known_ids = []
         
         for face_info in face_data:
             # Support multiple encodings per person
@@ -48,9 +60,34 @@ class FaceDetector:
             
             for encoding in encodings:
                 if encoding is not None:
-                    self.known_face_encodings.append(encoding)
-                    self.known_face_names.append(face_info['name'])
-                    self.known_face_ids.append(face_info['id'])
+                    known_encodings.append(encoding)
+                    known_names.append(face_info['name'])
+                    known_ids.append(face_info['id'])
+        
+        # One contiguous matrix so matching is a single vectorized distance pass
+        self._set_known_faces(np.array(known_encodings), known_names, known_ids)
+    
+    def load_known_face_matrix(self, ids: List[int], names: List[str], encodings: np.ndarray):
+        """
+        Load known faces from a precomputed encoding matrix
+        Args:
+            ids: User id for each row of encodings
+            names: User name for each row of encodings
+            encodings: (N, 128) array of face encodings
+        """
+        self._set_known_faces(np.asarray(encodings), list(names), list(ids))
+    
+    def _set_known_faces(self, encodings: np.ndarray, names: List[str], ids: List[int]):
+        """Swap in a new set of known faces so readers never see a partial update"""
+        with self._lock:
+            self.known_face_encodings, self.known_face_names, self.known_face_ids = encodings, names, ids
+            # Cached results were matched against the old known faces
+            self.detection_cache.clear()
+    
+    def _known_faces_snapshot(self) -> Tuple[np.ndarray, List[str], List[int]]:
+        """Return a consistent (encodings, names, ids) view of the known faces"""
+        with self._lock:
+            return self.known_face_encodings, self.known_face_names, self.known_face_ids
     
     def detect_faces_optimized(self, frame: np.ndarray, skip_frames: int = 2) -> List[Tuple]:
         """
@@ -65,13 +102,15 @@ class FaceDetector:
         frame_hash = hash(frame.tobytes())
         current_time = time.time()
         
-        if frame_hash in self.detection_cache:
-            cache_time, cached_result = self.detection_cache[frame_hash]
+        with self._lock:
+            cached = self.detection_cache.get(frame_hash)
+        if cached is not None:
+            cache_time, cached_result = cached
             if current_time - cache_time < self.cache_timeout:
                 return cached_result
         
         # Resize frame for faster processing
-        small_frame = cv2.resize(frame, (0, 0), fx=self.scale_factor, fy=self.scale_factor)
+        small_frame = self._downscale(frame, self.scale_factor)
         rgb_small_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
         
         # Fast face detection using HOG
@@ -79,13 +118,16 @@ class FaceDetector:
         
         if not face_locations:
             result = [("No face detected", None, 0.0)]
-            self.detection_cache[frame_hash] = (current_time, result)
+            with self._lock:
+                self.detection_cache[frame_hash] = (current_time, result)
             return result
         
         # Get face encodings
         face_encodings = fr.face_encodings(rgb_small_frame, face_locations, 
                                           num_jitters=self.num_jitters)
         
+        known_encodings, known_names, _ = self._known_faces_snapshot()
+        
         results = []
         for face_encoding, face_location in zip(face_encodings, face_locations):
             # Scale back the face location
@@ -96,14 +138,14 @@ class FaceDetector:
             left = int(left / self.scale_factor)
             scaled_location = (top, right, bottom, left)
             
-            if len(self.known_face_encodings) > 0:
+            if len(known_encodings) > 0:
                 # Fast face matching with vectorized operations
-                face_distances = fr.face_distance(self.known_face_encodings, face_encoding)
+                face_distances = fr.face_distance(known_encodings, face_encoding)
                 best_match_index = np.argmin(face_distances)
                 confidence = 1 - face_distances[best_match_index]
                 
                 if face_distances[best_match_index] <= self.tolerance:
-                    name = self.known_face_names[best_match_index]
+                    name = known_names[best_match_index]
                 else:
                     name = "Unknown Person"
                     confidence = 0.0
@@ -113,16 +155,21 @@ class FaceDetector:
             
             results.append((name, scaled_location, confidence))
         
-        # Cache the result
-        self.detection_cache[frame_hash] = (current_time, results)
-        
-        # Clean old cache entries
-        self._clean_cache(current_time)
+        # Cache the result and clean old cache entries
+        with self._lock:
+            self.detection_cache[frame_hash] = (current_time, results)
+            self._clean_cache(current_time)
         
         return results
     
+    def _downscale(self, frame: np.ndarray, scale_factor: float) -> np.ndarray:
+        """Resize frame by scale_factor, offloading to OpenCL when enabled"""
+        if self.use_opencl:
+            return cv2.resize(cv2.UMat(frame), (0, 0), fx=scale_factor, fy=scale_factor).get()
+        return cv2.resize(frame, (0, 0), fx=scale_factor, fy=scale_factor)
+    
     def _clean_cache(self, current_time: float):
-        """Clean expired cache entries"""
+        """Clean expired cache entries, caller must hold self._lock"""
         expired_keys = [k for k, (t, _) in self.detection_cache.items() 
                        if current_time - t > self.cache_timeout]
         for key in expired_keys:
@@ -138,26 +185,27 @@ class FaceDetector:
             List of tuples (name, confidence, location, user_id)
         """
         # Resize frame for faster processing
-        small_frame = cv2.resize(frame, (0, 0), fx=scale_factor, fy=scale_factor)
+        small_frame = self._downscale(frame, scale_factor)
         rgb_small_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
         
         # Find face locations and encodings
         face_locations = fr.face_locations(rgb_small_frame)
         face_encodings = fr.face_encodings(rgb_small_frame, face_locations)
         
+        known_encodings, known_names, known_ids = self._known_faces_snapshot()
         detected_faces = []
         
         for face_encoding, face_location in zip(face_encodings, face_locations):
             # Compare with known faces
-            if len(self.known_face_encodings) > 0:
-                matches = fr.compare_faces(self.known_face_encodings, face_encoding)
-                face_distances = fr.face_distance(self.known_face_encodings, face_encoding)
+            if len(known_encodings) > 0:
+                matches = fr.compare_faces(known_encodings, face_encoding)
+                face_distances = fr.face_distance(known_encodings, face_encoding)
                 
                 best_match_index = np.argmin(face_distances)
                 
                 if matches[best_match_index]:
-                    name = self.known_face_names[best_match_index]
-                    user_id = self.known_face_ids[best_match_index]
+                    name = known_names[best_match_index]
+                    user_id = known_ids[best_match_index]
                     confidence = 1 - face_distances[best_match_index]
                     
                     # Scale back up face location
@@ -241,23 +289,54 @@ class FaceDetector:
         
         return encodings
     
-    def average_encodings(self, encodings: List[np.ndarray]) -> np.ndarray:
+    def encode_faces_from_batch(self, images: List[np.ndarray],
+                                face_locations: Optional[List[Tuple]] = None) -> np.ndarray:
+        """
+        Detect and encode the first face of every image in one batch
+        Args:
+            images: List (or stacked array) of BGR images of the same person
+            face_locations: One already detected face location per image, skips re-detection when given
+        Returns:
+            (N, 128) array with one encoding per image where a face was found
+        """
+        rgb_images = [cv2.cvtColor(image, cv2.COLOR_BGR2RGB) for image in images]
+        
+        if face_locations is not None:
+            batch_locations = [[face_location] for face_location in face_locations]
+        # The CNN detector can run the whole batch in one call when the shapes match
+        elif self.model == "cnn" and len({image.shape for image in rgb_images}) == 1:
+            batch_locations = fr.batch_face_locations(rgb_images, batch_size=len(rgb_images))
+        else:
+            batch_locations = [fr.face_locations(image, model=self.model) for image in rgb_images]
+        
+        # Same single jitter as encode_face_from_frame, so one photo and many photos encode alike
+        encodings = []
+        for rgb_image, image_locations in zip(rgb_images, batch_locations):
+            if image_locations:
+                encodings.extend(fr.face_encodings(rgb_image, image_locations[:1]))
+        
+        return np.array(encodings, dtype=np.float64).reshape(-1, 128)
+    
+    def average_encodings(self, encodings: List[np.ndarray], normalize: bool = False) -> np.ndarray:
         """
         Average multiple face encodings for better representation
         Args:
             encodings: List of face encodings
+            normalize: L2-normalize each encoding and the mean before returning
         Returns:
             Averaged face encoding
         """
-        if not encodings:
+        if len(encodings) == 0:
             return None
         
-        if len(encodings) == 1:
-            return encodings[0]
-        
         # Stack and average the encodings
-        stacked_encodings = np.array(encodings)
+        stacked_encodings = np.asarray(encodings, dtype=np.float64)
+        if normalize:
+            stacked_encodings = stacked_encodings / np.linalg.norm(stacked_encodings, axis=1, keepdims=True)
+        
         averaged_encoding = np.mean(stacked_encodings, axis=0)
+        if normalize:
+            averaged_encoding /= np.linalg.norm(averaged_encoding)
         
         return averaged_encoding
     
@@ -283,50 +362,114 @@ class FaceDetector:
         
         return frame
     
-    def validate_face_quality(self, frame: np.ndarray) -> Tuple[bool, str]:
+    def detect_once(self, frame: np.ndarray) -> List[Tuple[int, int, int, int]]:
+        """
+        Run face detection once so the boxes can be shared by several consumers
+        Args:
+            frame: Input BGR image frame
+        Returns:
+            List of face locations (top, right, bottom, left)
+        """
+        return fr.face_locations(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+    
+    def encode_face_from_frame(self, frame: np.ndarray,
+                               face_locations: Optional[List[Tuple]] = None) -> Optional[np.ndarray]:
+        """
+        Extract the face encoding of the first face in a frame
+        Args:
+            frame: Input BGR image frame
+            face_locations: Already detected face locations, skips re-detection when given
+        Returns:
+            Face encoding array or None if no face found
+        """
+        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        if face_locations is None:
+            face_locations = fr.face_locations(rgb_frame)
+        
+        if len(face_locations) == 0:
+            return None
+        
+        face_encodings = fr.face_encodings(rgb_frame, face_locations[:1])
+        return face_encodings[0] if face_encodings else None
+    
+    def validate_face_quality(self, frame: np.ndarray) -> Tuple[bool, str, Optional[Tuple]]:
         """
         Validate if the face in frame is of good quality for recognition
         Args:
-            frame: Input image frame
+            frame: Input BGR image frame
         Returns:
-            (is_valid, message)
+            (is_valid, message, face_location) - face_location is None unless exactly one face was found
         """
         try:
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            face_locations = fr.face_locations(rgb_frame)
-            
-            if len(face_locations) == 0:
-                return False, "No face detected"
-            
-            if len(face_locations) > 1:
-                return False, "Multiple faces detected. Please ensure only one person is visible"
-            
-            # Check face size
-            top, right, bottom, left = face_locations[0]
-            face_width = right - left
-            face_height = bottom - top
-            
-            # Face should be at least 100x100 pixels
-            if face_width < 100 or face_height < 100:
-                return False, "Face too small. Please move closer to the camera"
-            
-            # Check if face is roughly centered
-            frame_height, frame_width = frame.shape[:2]
-            face_center_x = (left + right) // 2
-            face_center_y = (top + bottom) // 2
-            frame_center_x = frame_width // 2
-            frame_center_y = frame_height // 2
-            
-            if abs(face_center_x - frame_center_x) > frame_width * 0.3:
-                return False, "Please center your face horizontally"
-            
-            if abs(face_center_y - frame_center_y) > frame_height * 0.3:
-                return False, "Please center your face vertically"
-            
-            return True, "Face quality is good"
-            
+            face_locations = self.detect_once(frame)
+            is_valid, message = self.validate_face_quality_from_boxes(frame, face_locations)
+            face_location = face_locations[0] if len(face_locations) == 1 else None
+            return is_valid, message, face_location
         except Exception as e:
-            return False, f"Error validating face: {e}"
+            return False, f"Error validating face: {e}", None
+    
+    def validate_face_quality_from_boxes(self, frame: np.ndarray, face_locations: List[Tuple]) -> Tuple[bool, str]:
+        """
+        Validate face quality using face locations from an earlier detect_once call
+        Args:
+            frame: Input image frame
+            face_locations: Face locations (top, right, bottom, left) found in frame
+        Returns:
+            (is_valid, message)
+        """
+        if len(face_locations) == 0:
+            return False, "No face detected"
+        
+        if len(face_locations) > 1:
+            return False, "Multiple faces detected. Please ensure only one person is visible"
+        
+        # Check face size
+        top, right, bottom, left = face_locations[0]
+        face_width = right - left
+        face_height = bottom - top
+        
+        # Face should be at least 100x100 pixels
+        if face_width < 100 or face_height < 100:
+            return False, "Face too small. Please move closer to the camera"
+        
+        # Check if face is roughly centered
+        frame_height, frame_width = frame.shape[:2]
+        face_center_x = (left + right) // 2
+        face_center_y = (top + bottom) // 2
+        frame_center_x = frame_width // 2
+        frame_center_y = frame_height // 2
+        
+        if abs(face_center_x - frame_center_x) > frame_width * 0.3:
+            return False, "Please center your face horizontally"
+        
+        if abs(face_center_y - frame_center_y) > frame_height * 0.3:
+            return False, "Please center your face vertically"
+        
+        return True, "Face quality is good"
+    
+    def face_quality_score(self, frame: np.ndarray, face_location: Tuple) -> float:
+        """
+        Score a detected face by its size and sharpness
+        Args:
+            frame: Input image frame
+            face_location: Face location (top, right, bottom, left) in frame
+        Returns:
+            Quality between 0.0 and 1.0
+        """
+        top, right, bottom, left = face_location
+        h, w = frame.shape[:2]
+        face = frame[max(0, top):min(h, bottom), max(0, left):min(w, right)]
+        if face.size == 0:
+            return 0.0
+        
+        # A 200 px face scores full marks on size; validation rejects anything under 100 px
+        size_score = min(1.0, min(face.shape[:2]) / 200.0)
+        
+        # Variance of the Laplacian drops towards zero as the face blurs
+        gray = cv2.cvtColor(face, cv2.COLOR_BGR2GRAY)
+        sharpness_score = min(1.0, cv2.Laplacian(gray, cv2.CV_64F).var() / 100.0)
+        
+        return (size_score + sharpness_score) / 2.0
 
 class FaceEncoder:
     @staticmethod
@@ -8,9 +8,13 @@ including saving and loading face encodings from files.
 import numpy as np
 import pickle
 import os
-from typing import Optional, Dict, Any
+import tempfile
+from typing import Optional, Dict, Any, List
 import logging
 
+# File holding every known encoding as one contiguous matrix
+ENCODING_CACHE_FILE = "face_encodings.pkl"
+
 class FaceEncoder:
     """Utility class for face encoding operations"""
     
@@ -106,6 +110,67 @@ class FaceEncoder:
         
         return encodings
     
+    def save_encoding_cache(self, face_data: List[Dict[str, Any]]) -> bool:
+        """
+        Persist all known encodings as one (N, 128) matrix with parallel id/name lists
+        Args:
+            face_data: Entries from DatabaseManager.get_user_face_encodings
+        Returns:
+            bool: True if successful
+        """
+        try:
+            cache = {
+                'ids': [face_info['id'] for face_info in face_data],
+                'names': [face_info['name'] for face_info in face_data],
+                'encodings': (np.stack([np.asarray(face_info['encoding']) for face_info in face_data])
+                              if face_data else np.empty((0, 128)))
+            }
+            
+            # Write to a temp file and rename it over the cache so readers never see a partial pickle
+            filepath = os.path.join(self.encodings_dir, ENCODING_CACHE_FILE)
+            fd, tmp_path = tempfile.mkstemp(dir=self.encodings_dir, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    pickle.dump(cache, f)
+                os.replace(tmp_path, filepath)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+            
+            return True
+        except Exception as e:
+            logging.error(f"Error saving face encoding cache: {e}")
+            return False
+    
+    def load_encoding_cache(self) -> Optional[Dict[str, Any]]:
+        """
+        Load the encoding matrix written by save_encoding_cache
+        Returns:
+            Dictionary with 'ids', 'names' and 'encodings', or None if not available
+        """
+        try:
+            filepath = os.path.join(self.encodings_dir, ENCODING_CACHE_FILE)
+            
+            if not os.path.exists(filepath):
+                return None
+            
+            with open(filepath, 'rb') as f:
+                return pickle.load(f)
+        except Exception as e:
+            logging.error(f"Error loading face encoding cache: {e}")
+            return None
+    
+    def encoding_cache_mtime(self) -> Optional[int]:
+        """
+        Modification time of the encoding cache, used to notice when it has been rewritten
+        Returns:
+            mtime in nanoseconds, or None if the cache does not exist
+        """
+        try:
+            return os.stat(os.path.join(self.encodings_dir, ENCODING_CACHE_FILE)).st_mtime_ns
+        except OSError:
+            return None
+    
     def validate_encoding(self, face_encoding: np.ndarray) -> bool:
         """
         Validate face encoding format
@@ -5,83 +5,152 @@ from PIL import Image
 import os
 from datetime import datetime
 import time
+import threading
 from streamlit_webrtc import webrtc_streamer, VideoTransformerBase, RTCConfiguration
 import av
-from database.db_manager import DatabaseManager
-from face_detection.face_detector import FaceDetector
+from face_detection.face_detector import USE_OPENCL
 from face_detection.anti_spoofing import LivenessDetector
+from face_detection._overlay import draw_box_and_bar
+from utils.resources import get_db_manager, get_face_detector, invalidate_user_caches
+from config.performance_config import WEBRTC_CONFIG
 
 # WebRTC configuration
 RTC_CONFIGURATION = RTCConfiguration({
     "iceServers": [{"urls": ["stun:stun.l.google.com:19302"]}]
 })
 
+# Seconds a capture request may wait for a valid, live face before it is dropped
+CAPTURE_TIMEOUT = 15.0
+
+# Detect faces on every Nth frame; frames in between reuse the last boxes
+DETECTION_INTERVAL = 2
+
+# Detect on a half-size frame ("detect small, encode large"); encoding uses the full frame
+DETECTION_SCALE = 0.5
+
+# Ask the browser for a capped capture size/rate instead of the camera's native mode
+REGISTRATION_VIDEO_CONSTRAINTS = {
+    key: {"ideal": value} for key, value in WEBRTC_CONFIG['video_constraints'].items()
+}
+
 class FaceRegistrationTransformer(VideoTransformerBase):
     def __init__(self):
-        self.face_detector = FaceDetector()
+        # The detector is shared; liveness keeps per-viewer blink state, so each session owns one
+        self.face_detector = get_face_detector()
         self.liveness_detector = LivenessDetector()
+        
+        # Boxes from the last detection, reused until the next detected frame
+        self.frame_counter = 0
+        self.last_boxes = []
+        
+        # Result slot shared with the Streamlit thread, guarded by _lock
+        self._lock = threading.Lock()
         self.captured_frame = None
         self.face_encoding = None
         self.capture_requested = False
+        self.capture_deadline = 0.0
+        self.capture_timed_out = False  # Sticky until the next request_capture/reset
         self.registration_complete = False
         self.status_message = "Position your face in the center and look at camera"
         
     def recv(self, frame):
         img = frame.to_ndarray(format="bgr24")
         
-        # Process frame for face validation and liveness
-        face_valid, face_message = self.face_detector.validate_face_quality(img)
-        is_live, detection_complete, liveness_message, processed_frame = self.liveness_detector.process_frame(img)
+        # Detect once on a downscaled copy and share the boxes with validation and liveness
+        fresh_detection = self.frame_counter % DETECTION_INTERVAL == 0
+        self.frame_counter += 1
+        if fresh_detection:
+            src = cv2.UMat(img) if USE_OPENCL else img
+            small = cv2.resize(src, (0, 0), fx=DETECTION_SCALE, fy=DETECTION_SCALE, interpolation=cv2.INTER_AREA)
+            if USE_OPENCL:
+                small = small.get()  # dlib only takes host arrays
+            self.last_boxes = [tuple(int(coord / DETECTION_SCALE) for coord in box)
+                               for box in self.face_detector.detect_once(small)]
+        boxes = self.last_boxes
+        face_valid, face_message = self.face_detector.validate_face_quality_from_boxes(img, boxes)
+        is_live, detection_complete, liveness_message, processed_frame = self.liveness_detector.process_frame_with_boxes(img.copy(), boxes)
         
-        # Update status message
-        if not face_valid:
-            self.status_message = face_message
-            color = (0, 0, 255)  # Red
-        elif not detection_complete:
-            self.status_message = liveness_message
-            color = (255, 255, 0)  # Yellow
-        elif detection_complete and is_live and face_valid:
-            self.status_message = "✅ Ready to capture! Click 'Capture Face' button"
-            color = (0, 255, 0)  # Green
-            
-            # Auto-capture if requested
-            if self.capture_requested and not self.registration_complete:
-                self.captured_frame = img.copy()
-                self.face_encoding = self.face_detector.encode_face_from_frame(img)
-                self.registration_complete = True
-                self.status_message = "✅ Face captured successfully!"
+        with self._lock:
+            # Give up on a capture request that has outlived its time budget
+            if self.capture_requested and time.monotonic() > self.capture_deadline:
                 self.capture_requested = False
-        else:
-            self.status_message = "❌ Liveness check failed - please blink naturally"
-            color = (0, 0, 255)  # Red
+                self.capture_timed_out = True
+            
+            if self.capture_timed_out:
+                self.status_message = "⌛ Capture timed out - click 'Capture Face' to try again"
+                color = (0, 0, 255)  # Red
+            # Update status message
+            elif not face_valid:
+                self.status_message = face_message
+                color = (0, 0, 255)  # Red
+            elif not detection_complete:
+                self.status_message = liveness_message
+                color = (255, 255, 0)  # Yellow
+            elif detection_complete and is_live and face_valid:
+                self.status_message = "✅ Ready to capture! Click 'Capture Face' button"
+                color = (0, 255, 0)  # Green
+                
+                # Auto-capture if requested, only when the boxes were detected on this very frame
+                if fresh_detection and self.capture_requested and not self.registration_complete:
+                    self.captured_frame = img
+                    self.face_encoding = self.face_detector.encode_face_from_frame(img, face_locations=boxes[:1])
+                    self.registration_complete = True
+                    self.status_message = "✅ Face captured successfully!"
+                    self.capture_requested = False
+            else:
+                self.status_message = "❌ Liveness check failed - please blink naturally"
+                color = (0, 0, 255)  # Red
+            
+            status_message = self.status_message
+        
+        # Annotate on the OpenCL device when enabled and download once for display
+        frame_height = processed_frame.shape[0]
+        overlay = cv2.UMat(processed_frame) if USE_OPENCL else processed_frame
         
         # Add status text to frame
-        cv2.putText(processed_frame, self.status_message, (10, 30),
+        cv2.putText(overlay, status_message, (10, 30),
                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
         
         # Add instruction text
-        cv2.putText(processed_frame, "Look directly at camera and blink naturally", (10, processed_frame.shape[0] - 20),
+        cv2.putText(overlay, "Look directly at camera and blink naturally", (10, frame_height - 20),
                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
         
+        if USE_OPENCL:
+            processed_frame = overlay.get()
+        
+        # Face box and status bar as direct slice fills
+        top, right, bottom, left = boxes[0] if boxes else (-1, -1, -1, -1)
+        draw_box_and_bar(processed_frame, top, right, bottom, left, color)
+        
         return av.VideoFrame.from_ndarray(processed_frame, format="bgr24")
     
+    def get_result(self):
+        """Snapshot of (status_message, registration_complete, captured_frame, face_encoding)"""
+        with self._lock:
+            return self.status_message, self.registration_complete, self.captured_frame, self.face_encoding
+    
     def request_capture(self):
         """Request face capture on next valid frame"""
-        self.capture_requested = True
-        self.liveness_detector.reset()
+        with self._lock:
+            self.capture_requested = True
+            self.capture_deadline = time.monotonic() + CAPTURE_TIMEOUT
+            self.capture_timed_out = False
+            self.liveness_detector.reset()
     
     def reset(self):
         """Reset the transformer state"""
-        self.captured_frame = None
-        self.face_encoding = None
-        self.capture_requested = False
-        self.registration_complete = False
-        self.liveness_detector.reset()
-        self.status_message = "Position your face in the center and look at camera"
+        with self._lock:
+            self.captured_frame = None
+            self.face_encoding = None
+            self.capture_requested = False
+            self.capture_timed_out = False
+            self.registration_complete = False
+            self.liveness_detector.reset()
+            self.status_message = "Position your face in the center and look at camera"
 
 class CameraRegistrationPage:
     def __init__(self):
-        self.db_manager = DatabaseManager()
+        self.db_manager = get_db_manager()
     
     def render(self):
         st.title("📷 Camera Registration")
@@ -140,7 +209,7 @@ class CameraRegistrationPage:
             key="face-registration",
             video_transformer_factory=FaceRegistrationTransformer,
             rtc_configuration=RTC_CONFIGURATION,
-            media_stream_constraints={"video": True, "audio": False},
+            media_stream_constraints={"video": REGISTRATION_VIDEO_CONSTRAINTS, "audio": False},
             async_processing=True,
         )
         
@@ -165,11 +234,12 @@ class CameraRegistrationPage:
         
         # Show current status
         if ctx.video_transformer:
+            status_message, registration_complete, captured_frame, _ = ctx.video_transformer.get_result()
             status_placeholder = st.empty()
-            status_placeholder.info(f"**Status:** {ctx.video_transformer.status_message}")
+            status_placeholder.info(f"**Status:** {status_message}")
             
             # Check if capture is complete
-            if ctx.video_transformer.registration_complete and ctx.video_transformer.captured_frame is not None:
+            if registration_complete and captured_frame is not None:
                 self._process_captured_face(ctx.video_transformer, name, employee_id, email, department)
     
     def _process_captured_face(self, transformer, name, employee_id, email, department):
@@ -178,7 +248,7 @@ class CameraRegistrationPage:
         
         # Display captured image
         st.subheader("📸 Captured Face")
-        captured_image = transformer.captured_frame
+        _, _, captured_image, _ = transformer.get_result()
         st.image(captured_image, channels="BGR", caption=f"Captured: {name}", width=400)
         
         # Show registration details
@@ -214,8 +284,7 @@ class CameraRegistrationPage:
         """Save the registration to database"""
         try:
             # Get face encoding
-            face_encoding = transformer.face_encoding
-            captured_frame = transformer.captured_frame
+            _, _, captured_frame, face_encoding = transformer.get_result()
             
             if face_encoding is None:
                 st.error("❌ Failed to extract face encoding. Please try again.")
@@ -238,11 +307,12 @@ class CameraRegistrationPage:
                 employee_id=employee_id,
                 email=email,
                 department=department,
-                face_encoding=face_encoding,
+                face_encodings=[face_encoding],
                 image_path=image_path
             )
             
             if user_id:
+                invalidate_user_caches()
                 st.success(f"🎉 Registration successful!")
                 st.balloons()
                 
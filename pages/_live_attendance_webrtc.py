@@ -3,26 +3,50 @@ from streamlit_webrtc import webrtc_streamer, VideoTransformerBase, RTCConfigura
 import av
 import cv2
 import numpy as np
+import pandas as pd
 import time
 from datetime import datetime, date
-from database.db_manager import DatabaseManager
-from face_detection.face_detector import FaceDetector
 from face_detection.anti_spoofing import LivenessDetector
+from face_detection._overlay import blit_text
+from utils.resources import (get_db_manager, get_face_detector, get_recognition_detector,
+                             invalidate_user_caches, user_cache)
 
 # WebRTC configuration for better connectivity
 RTC_CONFIGURATION = RTCConfiguration({
     "iceServers": [{"urls": ["stun:stun.l.google.com:19302"]}]
 })
 
+# Seconds between checks for a rewritten encoding cache from the video thread
+DETECTOR_RECHECK_INTERVAL = 5.0
+
+# Column order of DatabaseManager.get_attendance_records rows
+ATTENDANCE_COLUMNS = ['id', 'name', 'employee_id', 'department', 'check_in', 'check_out', 'date', 'confidence']
+
+@st.cache_data(ttl=10, show_spinner=False)
+def _load_todays_records(_db_manager, today):
+    """Fetch today's attendance records, cached briefly across reruns"""
+    return _db_manager.get_attendance_records(date=today)
+
+@user_cache
+@st.cache_data(ttl=10, show_spinner=False)
+def _load_all_users(_db_manager):
+    """Fetch all active users, cached briefly across reruns"""
+    return _db_manager.get_all_users()
+
+def _clear_attendance_cache():
+    """Invalidate cached attendance data after a write"""
+    _load_todays_records.clear()
+    _load_all_users.clear()
+
 class FaceRecognitionTransformer(VideoTransformerBase):
     def __init__(self):
-        self.db_manager = DatabaseManager()
-        self.face_detector = FaceDetector()
-        self.liveness_detector = LivenessDetector()
+        # Heavy objects are shared by every WebRTC session in this process
+        self.db_manager = get_db_manager()
+        self.face_detector = get_recognition_detector()
+        self.detector_checked_at = time.monotonic()
         
-        # Load known faces
-        face_data = self.db_manager.get_user_face_encodings()
-        self.face_detector.load_known_faces(face_data)
+        # Liveness keeps per-viewer blink state, so each session owns one
+        self.liveness_detector = LivenessDetector()
         
         self.confidence_threshold = 0.5
         self.enable_liveness = True
@@ -72,8 +96,11 @@ class FaceRecognitionTransformer(VideoTransformerBase):
     
     def _handle_unknown_person(self, location):
         """Handle unknown person detection"""
-        # Generate unique ID for unknown person based on location
-        location_key = f"{location[0]}_{location[1]}_{location[2]}_{location[3]}"
+        # Pack the four 16-bit box coordinates into one int key for this location
+        location_key = ((location[0] & 0xFFFF)
+                        | ((location[1] & 0xFFFF) << 16)
+                        | ((location[2] & 0xFFFF) << 32)
+                        | ((location[3] & 0xFFFF) << 48))
         
         if location_key not in self.unknown_persons:
             self.unknown_counter += 1
@@ -99,14 +126,27 @@ class FaceRecognitionTransformer(VideoTransformerBase):
         
         self.frame_skip_count = 0
         
+        # Pick up registrations saved since the last check, without a stat on every frame
+        now = time.monotonic()
+        if now - self.detector_checked_at >= DETECTOR_RECHECK_INTERVAL:
+            self.face_detector = get_recognition_detector()
+            self.detector_checked_at = now
+        
         # Process frame for face recognition with optimization
         detected_faces = self.face_detector.detect_faces_optimized(img, skip_frames=self.skip_frames)
         
+        # Empty frames (the common case in an unoccupied room) pass through untouched
+        has_face = bool(detected_faces) and detected_faces[0][0] != "No face detected"
+        if not has_face:
+            self.last_processed_result = []
+            return frame
+        
         # Process liveness detection if enabled
-        if self.enable_liveness and detected_faces and detected_faces[0][0] != "No face detected":
+        if self.enable_liveness:
             is_live, detection_complete, status_message, processed_frame = self.liveness_detector.process_frame(img)
         else:
-            processed_frame = img.copy()
+            # Draw directly on the decoded frame buffer
+            processed_frame = img
             is_live = True
             detection_complete = True
             status_message = "Ready for recognition"
@@ -165,15 +205,21 @@ class FaceRecognitionTransformer(VideoTransformerBase):
             return av.VideoFrame.from_ndarray(frame, format="bgr24")
         
         processed_frame = self._draw_recognition_results(frame, self.last_processed_result, 
-                                                       True, True, "Using cached results...")
+                                                       True, True, "Using cached results...",
+                                                       static_status=True)
         return av.VideoFrame.from_ndarray(processed_frame, format="bgr24")
     
-    def _draw_recognition_results(self, frame, results, is_live, detection_complete, status_message):
+    def _draw_recognition_results(self, frame, results, is_live, detection_complete, status_message,
+                                  static_status=False):
         """Draw recognition results on frame"""
-        # Add status text
+        # Add status text. Only fixed strings go through the sprite cache; liveness messages
+        # carry a countdown and blink count that change every frame and would just churn it
         status_color = (0, 255, 0) if is_live and detection_complete else (0, 255, 255)
-        cv2.putText(frame, status_message, (10, 30),
-                   cv2.FONT_HERSHEY_SIMPLEX, 0.6, status_color, 2)
+        if static_status:
+            blit_text(frame, status_message, (10, 30), status_color)
+        else:
+            cv2.putText(frame, status_message, (10, 30),
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.6, status_color, 2)
         
         # Draw face boxes and labels
         for result in results:
@@ -209,8 +255,7 @@ class FaceRecognitionTransformer(VideoTransformerBase):
         # Show unknown persons count
         if len(self.unknown_persons) > 0:
             unknown_text = f"Unknown persons detected: {len(self.unknown_persons)}"
-            cv2.putText(frame, unknown_text, (10, frame.shape[0] - 20),
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
+            blit_text(frame, unknown_text, (10, frame.shape[0] - 20), (0, 0, 255))
         
         return frame
     
@@ -245,6 +290,7 @@ class FaceRecognitionTransformer(VideoTransformerBase):
                     success = self.db_manager.mark_attendance(user_id, attendance_type='check_out')
                 
                 if success:
+                    _clear_attendance_cache()
                     st.session_state.last_attendance_message = message
                     st.session_state.last_attendance_time = datetime.now()
             else:
@@ -257,7 +303,7 @@ class FaceRecognitionTransformer(VideoTransformerBase):
 
 class LiveAttendancePageWebRTC:
     def __init__(self):
-        self.db_manager = DatabaseManager()
+        self.db_manager = get_db_manager()
         
         # Initialize attendance tracking mode in session state
         if 'attendance_mode' not in st.session_state:
@@ -291,6 +337,7 @@ class LiveAttendancePageWebRTC:
         with col3:
             if st.button("🔄 Reset Today's Status"):
                 # Option to reset attendance status for testing
+                _clear_attendance_cache()
                 st.info("Reset functionality - for admin use")
         
         # Settings
@@ -330,10 +377,13 @@ class LiveAttendancePageWebRTC:
         
         with col1:
             if st.button("🔄 Reload Face Database"):
-                if ctx.video_transformer:
-                    face_data = self.db_manager.get_user_face_encodings()
-                    ctx.video_transformer.face_detector.load_known_faces(face_data)
-                    st.success(f"Loaded {len(face_data)} face encodings")
+                # Rewriting the cache reloads the shared detector, so every open session picks it up
+                if invalidate_user_caches():
+                    face_detector = get_recognition_detector()
+                else:
+                    face_detector = get_face_detector()
+                    face_detector.load_known_faces(self.db_manager.get_user_face_encodings())
+                st.success(f"Loaded {len(face_detector.known_face_ids)} face encodings")
         
         with col2:
             if st.button("🧹 Reset Liveness"):
@@ -348,19 +398,19 @@ class LiveAttendancePageWebRTC:
             mode_color = {"check_in": "🟢", "check_out": "🔴", "auto": "🔵"}
             st.metric("🎯 Mode", f"{mode_color.get(attendance_mode, '⚪')} {attendance_mode.title()}")
         
-        # Today's attendance
+        # Today's attendance (fragments refresh on their own, independent of the stream)
         self._show_todays_attendance()
         
         # Today's attendance statistics
         self._show_attendance_stats()
     
+    @st.fragment(run_every=30)
     def _show_todays_attendance(self):
         """Show today's attendance records with proper datetime handling"""
         st.markdown("### 📋 Today's Attendance")
         
-        from datetime import date
         try:
-            today_records = self.db_manager.get_attendance_records(date=date.today())
+            today_records = _load_todays_records(self.db_manager, date.today())
         except Exception as e:
             st.error(f"Error fetching attendance records: {e}")
             return
@@ -369,91 +419,49 @@ class LiveAttendancePageWebRTC:
             st.info("No attendance records for today yet.")
             return
         
-        # Process records for display
-        attendance_data = []
-        for record in today_records:
-            try:
-                record_id, name, employee_id, department, check_in, check_out, date_val, confidence = record
-                
-                # Handle datetime conversion for check_in
-                if check_in:
-                    if isinstance(check_in, str):
-                        try:
-                            from datetime import datetime
-                            check_in_dt = datetime.fromisoformat(check_in.replace('Z', '+00:00'))
-                            check_in_str = check_in_dt.strftime("%H:%M:%S")
-                        except:
-                            check_in_str = str(check_in)
-                    else:
-                        check_in_str = check_in.strftime("%H:%M:%S")
-                else:
-                    check_in_str = "Not checked in"
-                
-                # Handle datetime conversion for check_out
-                if check_out:
-                    if isinstance(check_out, str):
-                        try:
-                            from datetime import datetime
-                            check_out_dt = datetime.fromisoformat(check_out.replace('Z', '+00:00'))
-                            check_out_str = check_out_dt.strftime("%H:%M:%S")
-                        except:
-                            check_out_str = str(check_out)
-                    else:
-                        check_out_str = check_out.strftime("%H:%M:%S")
-                else:
-                    check_out_str = "Not checked out"
-                
-                attendance_data.append({
-                    "Name": name,
-                    "Employee ID": employee_id,
-                    "Department": department or "N/A",
-                    "Check In": check_in_str,
-                    "Check Out": check_out_str,
-                    "Confidence": f"{confidence:.2f}" if confidence else "N/A"
-                })
-            except Exception as e:
-                st.warning(f"Error processing record: {e}")
-                continue
+        # Build the frame straight from the SQL row tuples and format column-wise
+        df = pd.DataFrame.from_records(today_records, columns=ATTENDANCE_COLUMNS)
+        df['check_in_str'] = pd.to_datetime(df['check_in'], errors='coerce').dt.strftime('%H:%M:%S').fillna('Not checked in')
+        df['check_out_str'] = pd.to_datetime(df['check_out'], errors='coerce').dt.strftime('%H:%M:%S').fillna('Not checked out')
+        df['department'] = df['department'].fillna('N/A')
+        confidence = df['confidence'].astype(float)  # an all-None column arrives as object dtype
+        df['confidence'] = confidence.map('{:.2f}'.format).where(confidence.notna(), 'N/A')
+        
+        display_df = df[['name', 'employee_id', 'department', 'check_in_str', 'check_out_str', 'confidence']].rename(columns={
+            'name': 'Name',
+            'employee_id': 'Employee ID',
+            'department': 'Department',
+            'check_in_str': 'Check In',
+            'check_out_str': 'Check Out',
+            'confidence': 'Confidence'
+        }).convert_dtypes()
         
         # Display as dataframe
-        if attendance_data:
-            st.dataframe(attendance_data, use_container_width=True)
-        else:
-            st.info("No valid attendance records to display.")
+        st.dataframe(display_df, use_container_width=True)
     
+    @st.fragment(run_every=30)
     def _show_attendance_stats(self):
         """Show today's attendance statistics"""
         st.markdown("### 📊 Today's Attendance Statistics")
         
-        from datetime import date
         try:
-            today_records = self.db_manager.get_attendance_records(date=date.today())
+            today_records = _load_todays_records(self.db_manager, date.today())
             
             # Calculate statistics
-            total_users = len(self.db_manager.get_all_users())
+            total_users = len(_load_all_users(self.db_manager))
             total_records = len(today_records)
             
-            # Count check-ins and check-outs
-            check_ins = 0
-            check_outs = 0
-            completed_attendance = 0
+            # Count check-ins and check-outs in one columnar pass
+            df = pd.DataFrame(today_records, columns=ATTENDANCE_COLUMNS)
+            checked_in = df['check_in'].notna().to_numpy()
+            checked_out = df['check_out'].notna().to_numpy()
             
-            user_status = {}
+            check_ins = int(checked_in.sum())
+            check_outs = int(checked_out.sum())
             
-            for record in today_records:
-                user_id = record[0]
-                check_in = record[4]
-                check_out = record[5]
-                
-                if check_in:
-                    check_ins += 1
-                    user_status[user_id] = 'checked_in'
-                
-                if check_out:
-                    check_outs += 1
-                    if user_id in user_status:
-                        user_status[user_id] = 'completed'
-                        completed_attendance += 1
+            # Status of every user who checked in today
+            user_status = np.where(checked_out[checked_in], 'completed', 'checked_in')
+            completed_attendance = int((user_status == 'completed').sum())
             
             # Display metrics
             col1, col2, col3, col4, col5 = st.columns(5)
@@ -475,12 +483,12 @@ class LiveAttendancePageWebRTC:
                 st.metric("📈 Attendance Rate", f"{attendance_rate:.1f}%")
             
             # Show status breakdown
-            if user_status:
+            if user_status.size:
                 st.markdown("#### 📋 User Status Breakdown")
                 status_counts = {
-                    'checked_in': sum(1 for status in user_status.values() if status == 'checked_in'),
-                    'completed': sum(1 for status in user_status.values() if status == 'completed'),
-                    'not_present': total_users - len(user_status)
+                    'checked_in': check_ins - completed_attendance,
+                    'completed': completed_attendance,
+                    'not_present': total_users - user_status.size
                 }
                 
                 col1, col2, col3 = st.columns(3)
@@ -1,24 +1,69 @@
 import streamlit as st
 import cv2
 import numpy as np
-from PIL import Image
+import pandas as pd
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from database.db_manager import DatabaseManager
-from face_detection.face_detector import FaceDetector
-from face_detection.anti_spoofing import LivenessDetector
+from utils.helpers import resize_image
+from utils.resources import get_db_manager, get_face_detector, invalidate_user_caches, user_cache
+
+# Uploaded photos are downscaled to fit this box before detection and archival
+UPLOAD_MAX_SIZE = (1280, 1280)
+
+# Fixed display width for uploaded and registered face images
+PREVIEW_WIDTH = 640
+
+@st.cache_resource
+def _get_registration_executor():
+    """Single background worker for image writes and user inserts"""
+    return ThreadPoolExecutor(max_workers=1)
+
+def _save_and_register_user(db_manager, image_path, image, user_fields):
+    """Write the face image and insert the user as one background task"""
+    try:
+        os.makedirs(os.path.dirname(image_path), exist_ok=True)
+        cv2.imwrite(image_path, image)
+        user_id = db_manager.add_user(image_path=image_path, **user_fields)
+    except Exception:
+        # Clean up saved image before the error reaches the page
+        if os.path.exists(image_path):
+            os.remove(image_path)
+        raise
+    
+    if user_id:
+        invalidate_user_caches()
+    elif os.path.exists(image_path):
+        # Clean up saved image
+        os.remove(image_path)
+    return user_id
+
+@user_cache
+@st.cache_data(ttl=60)
+def _load_users(_db_manager):
+    """Registered users, cached across reruns until the next add/delete"""
+    return _db_manager.get_all_users()
+
+def _clear_pending_registration():
+    """Clear session data for a new registration"""
+    st.session_state.pop('pending_registration', None)
+
+def _go_to_page(page):
+    """Switch the sidebar page; the upload fragment then reruns the whole app"""
+    st.session_state.current_page = page
+    st.session_state['upload_registration_navigate'] = True
 
 class RegisterPage:
     def __init__(self):
-        self.db_manager = DatabaseManager()
-        self.face_detector = FaceDetector()
-        self.liveness_detector = LivenessDetector()
+        self.db_manager = get_db_manager()
+        self.face_detector = get_face_detector()
     
     def render(self):
         st.title("👥 Register New Person")
         st.markdown("Add new students or employees to the attendance system")
         
-        # Create tabs for different registration methods
+        # Create tabs for different registration methods; each tab body is a
+        # fragment so its widgets only rerun that tab
         tab1, tab2, tab3 = st.tabs(["📷 Live Camera Registration", "📁 Upload Photo", "👥 View Registered Users"])
         
         with tab1:
@@ -30,6 +75,7 @@ class RegisterPage:
         with tab3:
             self.show_registered_users()
     
+    @st.fragment
     def _camera_registration_webrtc(self):
         """WebRTC-based camera registration with user details form"""
         st.subheader("📷 Live Camera Registration")
@@ -153,144 +199,7 @@ class RegisterPage:
             elif submit_manual:
                 st.error("Please fill in the required fields (Name and Employee ID)")
     
-    def _handle_camera_capture(self, name, employee_id, email, department):
-        """Handle camera capture with liveness detection"""
-        # Create placeholder for camera feed
-        camera_placeholder = st.empty()
-        status_placeholder = st.empty()
-        
-        # Initialize camera
-        cap = cv2.VideoCapture(0)
-        
-        if not cap.isOpened():
-            st.error("Unable to access camera. Please check camera permissions.")
-            return
-        
-        # Set camera properties
-        cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-        
-        # Reset liveness detector
-        self.liveness_detector.reset()
-        
-        capture_complete = False
-        face_encoding = None
-        captured_frame = None
-        
-        # Control buttons
-        col1, col2, col3 = st.columns(3)
-        
-        with col1:
-            if st.button("🔴 Stop Camera"):
-                cap.release()
-                camera_placeholder.empty()
-                status_placeholder.empty()
-                return
-        
-        with col2:
-            capture_button = st.button("📸 Capture Face")
-        
-        with col3:
-            if st.button("🔄 Reset"):
-                self.liveness_detector.reset()
-        
-        # Main capture loop
-        frame_count = 0
-        while not capture_complete:
-            ret, frame = cap.read()
-            
-            if not ret:
-                st.error("Failed to read from camera")
-                break
-            
-            frame_count += 1
-            
-            # Mirror the frame
-            frame = cv2.flip(frame, 1)
-            
-            # Process frame for liveness detection
-            is_live, detection_complete, status_message, processed_frame = self.liveness_detector.process_frame(frame)
-            
-            # Validate face quality
-            face_valid, face_message = self.face_detector.validate_face_quality(frame)
-            
-            # Add face validation message to frame
-            color = (0, 255, 0) if face_valid else (0, 0, 255)
-            cv2.putText(processed_frame, face_message, (10, 120),
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
-            
-            # Display frame
-            camera_placeholder.image(processed_frame, channels="BGR", use_column_width=True)
-            
-            # Update status
-            status_placeholder.info(f"**Status:** {status_message}")
-            
-            # Check if capture should be triggered
-            if capture_button or (detection_complete and is_live and face_valid):
-                if face_valid:
-                    # Extract face encoding
-                    face_encoding = self.face_detector.encode_face_from_frame(frame)
-                    
-                    if face_encoding is not None:
-                        captured_frame = frame.copy()
-                        capture_complete = True
-                        status_placeholder.success("✅ Face captured successfully!")
-                    else:
-                        status_placeholder.error("❌ Failed to extract face encoding. Please try again.")
-                else:
-                    status_placeholder.error(f"❌ {face_message}")
-            
-            # Break if user stops
-            if frame_count > 1000:  # Prevent infinite loop
-                break
-        
-        # Cleanup camera
-        cap.release()
-        
-        # Process registration if successful
-        if face_encoding is not None and captured_frame is not None:
-            # Save face image
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            image_filename = f"{employee_id}_{timestamp}.jpg"
-            image_path = os.path.join("data/faces", image_filename)
-            
-            # Create directory if it doesn't exist
-            os.makedirs(os.path.dirname(image_path), exist_ok=True)
-            
-            # Save image
-            cv2.imwrite(image_path, captured_frame)
-            
-            # Register user in database
-            user_id = self.db_manager.add_user(
-                name=name,
-                employee_id=employee_id,
-                email=email,
-                department=department,
-                face_encoding=face_encoding,
-                image_path=image_path
-            )
-            
-            if user_id:
-                st.success(f"✅ User '{name}' registered successfully with ID: {user_id}")
-                
-                # Display captured image
-                st.subheader("📸 Captured Image")
-                st.image(captured_frame, channels="BGR", caption=f"Registered: {name}", use_column_width=True)
-                
-                # Show registration details
-                with st.expander("📋 Registration Details"):
-                    st.write(f"**Name:** {name}")
-                    st.write(f"**Employee ID:** {employee_id}")
-                    st.write(f"**Email:** {email}")
-                    st.write(f"**Department:** {department}")
-                    st.write(f"**Registration Time:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-                    st.write(f"**Image Path:** {image_path}")
-            else:
-                st.error("❌ Registration failed. Employee ID might already exist.")
-                # Clean up saved image
-                if os.path.exists(image_path):
-                    os.remove(image_path)
-    
+    @st.fragment
     def _upload_registration(self):
         """Photo upload based registration"""
         st.subheader("Register using Photo Upload")
@@ -326,10 +235,11 @@ class RegisterPage:
                 st.info("ℹ️ Information pre-filled from camera registration tab")
             
             # File upload
-            uploaded_file = st.file_uploader(
-                "Choose a face image",
+            uploaded_files = st.file_uploader(
+                "Choose one or more face images",
                 type=['jpg', 'jpeg', 'png'],
-                help="Upload a clear photo showing the person's face"
+                accept_multiple_files=True,
+                help="Upload clear photos showing the person's face; several photos are averaged into one encoding"
             )
             
             # Photo requirements
@@ -347,142 +257,178 @@ class RegisterPage:
             
             submit_upload = st.form_submit_button("📤 Register with Photo")
             
-            if submit_upload and uploaded_file and name and employee_id:
+            if submit_upload and uploaded_files and name and employee_id:
                 # Clear pending registration
                 if 'pending_registration' in st.session_state:
                     del st.session_state['pending_registration']
-                self._process_uploaded_image(uploaded_file, name, employee_id, email, department)
+                self._process_uploaded_images(uploaded_files, name, employee_id, email, department)
             elif submit_upload:
                 st.error("Please fill in all required fields and upload an image")
+        
+        self._show_upload_registration_status()
     
-    def _process_uploaded_image(self, uploaded_file, name, employee_id, email, department):
-        """Process uploaded image for registration"""
+    def _process_uploaded_images(self, uploaded_files, name, employee_id, email, department):
+        """Process uploaded images for registration"""
         try:
-            # Convert uploaded file to opencv format
-            image = Image.open(uploaded_file)
-            image_array = np.array(image)
-            
-            # Convert RGB to BGR if needed
-            if len(image_array.shape) == 3 and image_array.shape[2] == 3:
-                image_array = cv2.cvtColor(image_array, cv2.COLOR_RGB2BGR)
-            
-            # Validate face quality
-            face_valid, face_message = self.face_detector.validate_face_quality(image_array)
+            images = []
+            for uploaded_file in uploaded_files:
+                # Decode straight from the upload buffer into a BGR array in one pass
+                data = np.frombuffer(uploaded_file.getvalue(), np.uint8)
+                image = cv2.imdecode(data, cv2.IMREAD_COLOR)  # BGR already
+                
+                if image is None:
+                    st.error(f"❌ Could not decode {uploaded_file.name}. Please upload valid JPG or PNG files.")
+                    return
+                
+                # Cap the size used for detection and archival; accuracy saturates well below this
+                images.append(resize_image(image, *UPLOAD_MAX_SIZE))
+            
+            # Every photo must show exactly one well-framed face, otherwise another person could be averaged in
+            face_locations = []
+            rejected = []
+            for uploaded_file, image in zip(uploaded_files, images):
+                face_valid, face_message, face_location = self.face_detector.validate_face_quality(image)
+                if face_valid:
+                    face_locations.append(face_location)
+                else:
+                    rejected.append((uploaded_file.name, face_message, image))
             
-            if not face_valid:
-                st.error(f"❌ {face_message}")
-                st.image(image, caption="Uploaded Image", use_column_width=True)
+            if rejected:
+                for file_name, face_message, image in rejected:
+                    st.error(f"❌ {file_name}: {face_message}")
+                    st.image(image, channels="BGR", caption=file_name, width=PREVIEW_WIDTH)
                 return
             
-            # Extract face encoding
-            face_encoding = self.face_detector.encode_face_from_frame(image_array)
+            # The first photo is archived as the user's thumbnail
+            image_array = images[0]
+            face_location = face_locations[0]
+            
+            # Extract face encodings
+            if len(images) == 1:
+                face_encoding = self.face_detector.encode_face_from_frame(image_array, face_locations=[face_location])
+            else:
+                batch_encodings = self.face_detector.encode_faces_from_batch(images, face_locations=face_locations)
+                face_encoding = self.face_detector.average_encodings(batch_encodings, normalize=True)
             
             if face_encoding is None:
-                st.error("❌ No face detected in the uploaded image. Please upload a clear face photo.")
+                st.error("❌ No face detected in the uploaded images. Please upload clear face photos.")
                 return
             
-            # Save image
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             image_filename = f"{employee_id}_{timestamp}.jpg"
             image_path = os.path.join("data/faces", image_filename)
             
-            # Create directory if it doesn't exist
-            os.makedirs(os.path.dirname(image_path), exist_ok=True)
-            
-            # Save image
-            cv2.imwrite(image_path, image_array)
-            
-            # Register user in database
-            user_id = self.db_manager.add_user(
-                name=name,
-                employee_id=employee_id,
-                email=email,
-                department=department,
-                face_encoding=face_encoding,
-                image_path=image_path
+            # Write the image and insert the user off the script thread
+            future = _get_registration_executor().submit(
+                _save_and_register_user, self.db_manager, image_path, image_array,
+                dict(name=name, employee_id=employee_id, email=email, department=department,
+                     face_encodings=[face_encoding])
             )
-            
-            if user_id:
-                st.success(f"✅ User '{name}' registered successfully with ID: {user_id}")
-                
-                # Display processed image with face detection
-                detected_faces = self.face_detector.detect_faces_in_frame(image_array)
-                if detected_faces:
-                    processed_image = self.face_detector.draw_face_boxes(image_array.copy(), [(name, 1.0, detected_faces[0][2], user_id)])
-                    st.image(processed_image, channels="BGR", caption="Registered Face", use_column_width=True)
-                else:
-                    st.image(image, caption="Registered Image", use_column_width=True)
-                
-                # Show registration details
-                with st.expander("📋 Registration Details"):
-                    st.write(f"**Name:** {name}")
-                    st.write(f"**Employee ID:** {employee_id}")
-                    st.write(f"**Email:** {email}")
-                    st.write(f"**Department:** {department}")
-                    st.write(f"**Registration Time:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-                
-                # Navigation options after successful registration
-                st.markdown("### 🚀 What's Next?")
-                col1, col2, col3 = st.columns(3)
-                
-                with col1:
-                    if st.button("👥 Register Another User", key="upload_register_another"):
-                        # Clear session data for new registration
-                        if 'pending_registration' in st.session_state:
-                            del st.session_state['pending_registration']
-                        st.rerun()
-                
-                with col2:
-                    if st.button("🎥 Test Live Attendance", key="upload_test_attendance"):
-                        st.session_state.current_page = "🎥 Live Attendance"
-                        st.success("✅ Redirecting to Live Attendance...")
-                        st.rerun()
-                
-                with col3:
-                    if st.button("📊 View Reports", key="upload_view_reports"):
-                        st.session_state.current_page = "📊 Reports & Analytics"
-                        st.success("✅ Redirecting to Reports...")
-                        st.rerun()
-            else:
-                st.error("❌ Registration failed. Employee ID might already exist.")
-                # Clean up saved image
-                if os.path.exists(image_path):
-                    os.remove(image_path)
+            st.session_state['upload_registration_job'] = {
+                'future': future,
+                'name': name,
+                'employee_id': employee_id,
+                'email': email,
+                'department': department,
+                'image': image_array,
+                'face_location': face_location,
+                'submitted_at': datetime.now()
+            }
                     
         except Exception as e:
             st.error(f"❌ Error processing image: {str(e)}")
     
+    def _show_upload_registration_status(self):
+        """Show the outcome of the background upload registration, if any"""
+        # Button callbacks cannot rerun the app, and this runs inside a fragment
+        if st.session_state.pop('upload_registration_navigate', False):
+            st.rerun()
+        
+        job = st.session_state.get('upload_registration_job')
+        if job is None:
+            return
+        
+        if not job['future'].done():
+            self._wait_for_upload_registration()
+            return
+        
+        # The outcome is shown once; later reruns start from a clean form
+        del st.session_state['upload_registration_job']
+        
+        name = job['name']
+        try:
+            user_id = job['future'].result()
+        except Exception as e:
+            st.error(f"❌ Error processing image: {str(e)}")
+            return
+        
+        if not user_id:
+            st.error("❌ Registration failed. Employee ID might already exist.")
+            return
+        
+        st.success(f"✅ User '{name}' registered successfully with ID: {user_id}")
+        
+        # Display processed image with the box found during validation
+        processed_image = self.face_detector.draw_face_boxes(job['image'].copy(), [(name, 1.0, job['face_location'], user_id)])
+        st.image(processed_image, channels="BGR", caption="Registered Face", width=PREVIEW_WIDTH)
+        
+        # Show registration details
+        with st.expander("📋 Registration Details"):
+            st.write(f"**Name:** {name}")
+            st.write(f"**Employee ID:** {job['employee_id']}")
+            st.write(f"**Email:** {job['email']}")
+            st.write(f"**Department:** {job['department']}")
+            st.write(f"**Registration Time:** {job['submitted_at'].strftime('%Y-%m-%d %H:%M:%S')}")
+        
+        # Navigation options after successful registration. The job is already gone on the
+        # next rerun, so the buttons act through callbacks instead of their return value.
+        st.markdown("### 🚀 What's Next?")
+        col1, col2, col3 = st.columns(3)
+        
+        with col1:
+            st.button("👥 Register Another User", key="upload_register_another",
+                      on_click=_clear_pending_registration)
+        
+        with col2:
+            st.button("🎥 Test Live Attendance", key="upload_test_attendance",
+                      on_click=_go_to_page, args=("🎥 Live Attendance",))
+        
+        with col3:
+            st.button("📊 View Reports", key="upload_view_reports",
+                      on_click=_go_to_page, args=("📊 Reports & Analytics",))
+    
+    @st.fragment(run_every=1)
+    def _wait_for_upload_registration(self):
+        """Poll the background registration and rerun the page once it finishes"""
+        job = st.session_state.get('upload_registration_job')
+        if job is None or job['future'].done():
+            st.rerun()
+        st.info("⏳ Registration in progress...")
+    
+    @st.fragment
     def show_registered_users(self):
         """Display all registered users"""
         st.subheader("📋 Registered Users")
         
-        users = self.db_manager.get_all_users()
+        users = _load_users(self.db_manager)
         
         if not users:
             st.info("No users registered yet.")
             return
         
         # Display users in a table
-        user_data = []
-        for user in users:
-            user_id, name, employee_id, email, department, image_path, created_at = user
-            user_data.append({
-                "ID": user_id,
-                "Name": name,
-                "Employee ID": employee_id,
-                "Email": email or "N/A",
-                "Department": department or "N/A",
-                "Registered": created_at
-            })
+        df = pd.DataFrame(users, columns=["ID", "Name", "Employee ID", "Email", "Department", "image_path", "Registered"])
+        df[["Email", "Department"]] = df[["Email", "Department"]].replace("", np.nan).fillna("N/A")
         
-        st.dataframe(user_data, use_container_width=True)
+        st.dataframe(df.drop(columns=["image_path"]), use_container_width=True)
         
         # User management options
         with st.expander("👥 User Management"):
+            label_map = {u[0]: f"{u[1]} ({u[2]})" for u in users}
             selected_user_id = st.selectbox(
                 "Select user to manage:",
-                options=[user[0] for user in users],
-                format_func=lambda x: f"{dict([(u[0], f'{u[1]} ({u[2]})') for u in users]).get(x, x)}"
+                options=list(label_map),
+                format_func=label_map.get
             )
             
             col1, col2 = st.columns(2)
@@ -490,6 +436,7 @@ class RegisterPage:
             with col1:
                 if st.button("🗑️ Delete User"):
                     if self.db_manager.delete_user(selected_user_id):
+                        invalidate_user_caches()
                         st.success("User deleted successfully!")
                         st.rerun()
                     else:
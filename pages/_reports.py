@@ -1,13 +1,67 @@
 import streamlit as st
 import pandas as pd
+import io
 from datetime import datetime, date, timedelta
-from database.db_manager import DatabaseManager
-import plotly.express as px
-import plotly.graph_objects as go
+from utils.resources import get_db_manager, user_cache
+
+ATTENDANCE_COLUMNS = [
+    'id', 'name', 'employee_id', 'department', 'check_in_time',
+    'check_out_time', 'date', 'confidence'
+]
+
+# Rows shown in the detailed table before "Show all" is ticked
+TABLE_PREVIEW_ROWS = 500
+
+@st.cache_data(ttl=60, max_entries=4, show_spinner=False)
+def _load_records(_db_manager, start_date, end_date):
+    """Fetch attendance records within a date range, cached across reruns"""
+    return _db_manager.get_attendance_records(start_date=start_date, end_date=end_date)
+
+@user_cache
+@st.cache_data(ttl=60, max_entries=4, show_spinner=False)
+def _load_users(_db_manager):
+    """Fetch all active users, cached across reruns"""
+    return _db_manager.get_all_users()
+
+@user_cache
+@st.cache_data(ttl=60, max_entries=4, show_spinner=False)
+def _load_user_index(_db_manager):
+    """Users and their selectbox labels keyed by employee_id, cached across reruns"""
+    users = _load_users(_db_manager)
+    return {u[2]: u for u in users}, {u[2]: f"{u[1]} ({u[2]})" for u in users}
+
+@st.cache_data(ttl=60, max_entries=8, show_spinner=False)
+def _df_to_csv(cache_key, _df):
+    """Serialise a report frame to CSV bytes, cached on a cheap caller-supplied key"""
+    buffer = io.BytesIO()
+    # Written straight into the byte buffer in row chunks, without an intermediate str
+    _df.to_csv(buffer, index=False, chunksize=10_000)
+    return buffer.getvalue()
+
+@st.cache_data(ttl=60, max_entries=8, show_spinner=False)
+def _df_to_parquet(cache_key, _df):
+    """Serialise a report frame to Parquet bytes, cached on a cheap caller-supplied key"""
+    buffer = io.BytesIO()
+    _df.to_parquet(buffer, index=False)
+    return buffer.getvalue()
+
+@st.cache_data(ttl=60, max_entries=4, show_spinner=False)
+def _per_user_stats(start_date, end_date, _df):
+    """Per-employee attendance aggregates for a date range, cached across reruns"""
+    return _df.assign(
+        confidence=_df['confidence'].fillna(0),  # missing scores count as zero
+        has_check_in=_df['check_in_time'].notna(),
+        has_check_out=_df['check_out_time'].notna()
+    ).groupby('employee_id').agg(
+        days=('id', 'size'),
+        avg_confidence=('confidence', 'mean'),
+        check_ins=('has_check_in', 'sum'),
+        check_outs=('has_check_out', 'sum')
+    )
 
 class ReportsPage:
     def __init__(self):
-        self.db_manager = DatabaseManager()
+        self.db_manager = get_db_manager()
     
     def render(self):
         st.title("📊 Attendance Reports & Analytics")
@@ -24,6 +78,10 @@ class ReportsPage:
         
         with col3:
             if st.button("🔄 Refresh Data"):
+                _load_records.clear()
+                _load_users.clear()
+                _load_user_index.clear()
+                _per_user_stats.clear()
                 st.rerun()
         
         # Validate date range
@@ -31,53 +89,42 @@ class ReportsPage:
             st.error("Start date must be before end date")
             return
         
-        # Get attendance data
-        attendance_records = self.db_manager.get_attendance_records()
-        
-        # Filter records by date range with proper date handling
-        filtered_records = []
-        for record in attendance_records:
-            try:
-                record_date = record[6]  # Date field
-                
-                # Handle both string and date object types
-                if isinstance(record_date, str):
-                    # Parse string date
-                    record_date_obj = datetime.strptime(record_date, '%Y-%m-%d').date()
-                elif hasattr(record_date, 'date'):
-                    # datetime object - extract date part
-                    record_date_obj = record_date.date()
-                else:
-                    # Already a date object
-                    record_date_obj = record_date
-                
-                # Check if date is in range
-                if start_date <= record_date_obj <= end_date:
-                    filtered_records.append(record)
-                    
-            except (ValueError, AttributeError, TypeError) as e:
-                # Skip records with invalid dates
-                st.warning(f"Skipping record with invalid date: {record_date}")
-                continue
+        # Get attendance data, filtered by date range in SQL
+        attendance_records = _load_records(self.db_manager, start_date, end_date)
+        
+        # Parse dates in one vectorised pass; unparseable dates become NaT and fall out of the range mask
+        df_all = pd.DataFrame(attendance_records, columns=ATTENDANCE_COLUMNS)
+        df_all['date'] = pd.to_datetime(df_all['date'], errors='coerce')
+        
+        bad_dates = int(df_all['date'].isna().sum())
+        if bad_dates:
+            st.warning(f"Skipped {bad_dates} records with invalid dates")
+        
+        # Parse the timestamp columns once here; every section below reuses them
+        df_all['check_in_time'] = pd.to_datetime(df_all['check_in_time'], errors='coerce')
+        df_all['check_out_time'] = pd.to_datetime(df_all['check_out_time'], errors='coerce')
+        
+        # Few distinct departments, so group and filter on integer codes
+        df_all['department'] = df_all['department'].astype('category')
+        filtered_df = df_all[df_all['date'].between(pd.Timestamp(start_date), pd.Timestamp(end_date))]
         
         # Display different report sections
-        self._show_summary_stats(filtered_records, start_date, end_date)
-        self._show_attendance_charts(filtered_records)
-        self._show_detailed_reports(filtered_records)
-        self._show_user_analytics(filtered_records)
+        self._show_summary_stats(filtered_df, start_date, end_date)
+        self._show_attendance_charts(filtered_df)
+        self._show_detailed_reports(filtered_df)
+        self._show_user_analytics(filtered_df, _per_user_stats(start_date, end_date, filtered_df))
     
-    def _show_summary_stats(self, records, start_date, end_date):
+    def _show_summary_stats(self, df, start_date, end_date):
         """Display summary statistics"""
         st.subheader("📈 Summary Statistics")
         
         # Calculate metrics
-        total_users = len(self.db_manager.get_all_users())
-        total_records = len(records)
-        unique_attendees = len(set(record[2] for record in records))  # employee_id
+        total_users = len(_load_users(self.db_manager))
+        total_records = len(df)
+        unique_attendees = df['employee_id'].nunique()
         
-        # Check-in/check-out counts
-        check_ins = sum(1 for record in records if record[4])  # check_in_time
-        check_outs = sum(1 for record in records if record[5])  # check_out_time
+        # Check-in/check-out counts in one reduction over both columns
+        check_ins, check_outs = df[['check_in_time', 'check_out_time']].notna().sum().tolist()
         
         # Display metrics
         col1, col2, col3, col4, col5 = st.columns(5)
@@ -102,39 +149,36 @@ class ReportsPage:
             attendance_rate = (unique_attendees / total_users) * 100
             st.metric("📊 Attendance Rate", f"{attendance_rate:.1f}%")
     
-    def _show_attendance_charts(self, records):
+    def _show_attendance_charts(self, df):
         """Display attendance charts and visualizations"""
+        # Plotly is only imported once a chart is actually drawn
+        import plotly.express as px
+        import plotly.graph_objects as go
+        
         st.subheader("📊 Attendance Visualizations")
         
-        if not records:
+        if df.empty:
             st.info("No attendance data available for the selected date range.")
             return
         
-        # Prepare data for charts
-        df_records = pd.DataFrame(records, columns=[
-            'id', 'name', 'employee_id', 'department', 'check_in_time', 
-            'check_out_time', 'date', 'confidence'
-        ])
+        # Daily attendance chart, fed as NumPy arrays so Plotly ships typed buffers
+        daily_attendance = df.groupby('date').size()
         
-        # Convert date column
-        df_records['date'] = pd.to_datetime(df_records['date'])
-        
-        # Daily attendance chart
-        daily_attendance = df_records.groupby('date').size().reset_index(name='count')
-        
-        fig_daily = px.line(
-            daily_attendance, 
-            x='date', 
-            y='count',
+        fig_daily = go.Figure(go.Scatter(
+            x=daily_attendance.index.to_numpy(),
+            y=daily_attendance.to_numpy(),
+            mode='markers+lines'
+        ))
+        fig_daily.update_layout(
             title='Daily Attendance Trend',
-            labels={'count': 'Number of Attendees', 'date': 'Date'}
+            xaxis_title='Date',
+            yaxis_title='Number of Attendees'
         )
-        fig_daily.update_traces(mode='markers+lines')
         st.plotly_chart(fig_daily, use_container_width=True)
         
         # Department-wise attendance
-        if df_records['department'].notna().any():
-            dept_attendance = df_records.groupby('department').size().reset_index(name='count')
+        if df['department'].notna().any():
+            dept_attendance = df.groupby('department', observed=True).size().reset_index(name='count')
             
             fig_dept = px.pie(
                 dept_attendance,
@@ -144,14 +188,13 @@ class ReportsPage:
             )
             st.plotly_chart(fig_dept, use_container_width=True)
         
-        # Weekly attendance pattern
-        df_records['day_of_week'] = df_records['date'].dt.day_name()
-        weekly_attendance = df_records.groupby('day_of_week').size().reset_index(name='count')
-        
-        # Reorder days
+        # Weekly attendance pattern, grouped on the integer weekday so Monday-first order comes for free
         day_order = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-        weekly_attendance['day_of_week'] = pd.Categorical(weekly_attendance['day_of_week'], categories=day_order, ordered=True)
-        weekly_attendance = weekly_attendance.sort_values('day_of_week')
+        weekly_counts = df.groupby(df['date'].dt.dayofweek).size()
+        weekly_attendance = pd.DataFrame({
+            'day_of_week': [day_order[day] for day in weekly_counts.index],
+            'count': weekly_counts.to_numpy()
+        })
         
         fig_weekly = px.bar(
             weekly_attendance,
@@ -163,41 +206,40 @@ class ReportsPage:
         st.plotly_chart(fig_weekly, use_container_width=True)
         
         # Hourly attendance pattern
-        df_records['check_in_hour'] = pd.to_datetime(df_records['check_in_time']).dt.hour
-        hourly_attendance = df_records.dropna(subset=['check_in_hour']).groupby('check_in_hour').size().reset_index(name='count')
+        hourly_attendance = df.groupby(df['check_in_time'].dt.hour).size()
         
         if not hourly_attendance.empty:
-            fig_hourly = px.bar(
-                hourly_attendance,
-                x='check_in_hour',
-                y='count',
+            fig_hourly = go.Figure(go.Bar(
+                x=hourly_attendance.index.to_numpy(),
+                y=hourly_attendance.to_numpy()
+            ))
+            fig_hourly.update_layout(
                 title='Check-in Time Distribution',
-                labels={'count': 'Number of Check-ins', 'check_in_hour': 'Hour of Day'}
+                xaxis_title='Hour of Day',
+                yaxis_title='Number of Check-ins'
             )
             st.plotly_chart(fig_hourly, use_container_width=True)
     
-    def _show_detailed_reports(self, records):
+    @st.fragment
+    def _show_detailed_reports(self, df):
         """Show detailed attendance reports"""
         st.subheader("📋 Detailed Attendance Records")
         
-        if not records:
+        if df.empty:
             st.info("No records found for the selected date range.")
             return
         
-        # Convert to DataFrame for better display
-        df_records = pd.DataFrame(records, columns=[
+        # Rename to display headers
+        df_records = df.rename(columns=dict(zip(ATTENDANCE_COLUMNS, [
             'ID', 'Name', 'Employee ID', 'Department', 'Check In', 
             'Check Out', 'Date', 'Confidence'
-        ])
+        ])))
         
-        # Format datetime columns
-        df_records['Check In'] = pd.to_datetime(df_records['Check In']).dt.strftime('%H:%M:%S')
-        df_records['Check Out'] = pd.to_datetime(df_records['Check Out']).dt.strftime('%H:%M:%S')
-        df_records['Date'] = pd.to_datetime(df_records['Date']).dt.strftime('%Y-%m-%d')
-        
-        # Replace NaT with readable text
-        df_records['Check In'] = df_records['Check In'].replace('NaT', 'Not checked in')
-        df_records['Check Out'] = df_records['Check Out'].replace('NaT', 'Not checked out')
+        # Format the already-parsed datetime columns, masking NaT from the datetime dtype itself
+        check_in, check_out = df_records['Check In'], df_records['Check Out']
+        df_records['Check In'] = check_in.dt.strftime('%H:%M:%S').mask(check_in.isna(), 'Not checked in')
+        df_records['Check Out'] = check_out.dt.strftime('%H:%M:%S').mask(check_out.isna(), 'Not checked out')
+        df_records['Date'] = df_records['Date'].dt.strftime('%Y-%m-%d')
         
         # Format confidence
         df_records['Confidence'] = df_records['Confidence'].round(2)
@@ -221,69 +263,98 @@ class ReportsPage:
             with col3:
                 confidence_min = st.slider("Minimum Confidence", 0.0, 1.0, 0.0, 0.1)
         
-        # Apply filters
-        filtered_df = df_records.copy()
+        # Apply filters as one combined mask so only the final selection is materialised
+        mask = df_records['Confidence'].to_numpy() >= confidence_min
         
         if name_filter:
-            filtered_df = filtered_df[filtered_df['Name'].isin(name_filter)]
+            mask &= df_records['Name'].isin(name_filter).to_numpy()
         
         if dept_filter:
-            filtered_df = filtered_df[filtered_df['Department'].isin(dept_filter)]
+            mask &= df_records['Department'].isin(dept_filter).to_numpy()
         
-        filtered_df = filtered_df[filtered_df['Confidence'] >= confidence_min]
+        filtered_df = df_records[mask]
         
-        # Display filtered data
-        st.dataframe(filtered_df, use_container_width=True)
+        # Display filtered data; large results are capped unless explicitly requested
+        display_df = filtered_df
+        if len(filtered_df) > TABLE_PREVIEW_ROWS:
+            if not st.checkbox(f"Show all {len(filtered_df)} records", key="reports_show_all_records"):
+                display_df = filtered_df.head(TABLE_PREVIEW_ROWS)
+        
+        st.dataframe(
+            display_df,
+            use_container_width=True,
+            height=420,
+            column_config={
+                'Confidence': st.column_config.ProgressColumn(min_value=0.0, max_value=1.0, format="%.2f")
+            }
+        )
         
         # Export options
-        col1, col2 = st.columns(2)
+        col1, col2, col3 = st.columns(3)
+        
+        # Key on the filters plus a hash of the row ids instead of hashing the whole frame
+        export_key = (
+            tuple(sorted(name_filter)), tuple(sorted(dept_filter)), confidence_min, len(filtered_df),
+            int(pd.util.hash_pandas_object(filtered_df['ID'], index=False).sum())
+        )
+        file_stem = f"attendance_report_{datetime.now().strftime('%Y%m%d')}"
         
         with col1:
-            csv_data = filtered_df.to_csv(index=False)
             st.download_button(
                 label="📥 Download as CSV",
-                data=csv_data,
-                file_name=f"attendance_report_{datetime.now().strftime('%Y%m%d')}.csv",
+                data=_df_to_csv(export_key, filtered_df),
+                file_name=f"{file_stem}.csv",
                 mime="text/csv"
             )
         
         with col2:
+            st.download_button(
+                label="📦 Download as Parquet",
+                data=_df_to_parquet(export_key, filtered_df),
+                file_name=f"{file_stem}.parquet",
+                mime="application/octet-stream"
+            )
+        
+        with col3:
             st.write(f"**Total Records:** {len(filtered_df)}")
     
-    def _show_user_analytics(self, records):
+    @st.fragment
+    def _show_user_analytics(self, df, per_user):
         """Show individual user analytics"""
+        import plotly.express as px
+        import plotly.graph_objects as go
+        
         st.subheader("👤 Individual User Analytics")
         
-        if not records:
+        if df.empty:
             st.info("No data available for user analytics.")
             return
         
         # Get all users for selection
-        users = self.db_manager.get_all_users()
+        users_by_id, user_labels = _load_user_index(self.db_manager)
         
-        if not users:
+        if not users_by_id:
             st.info("No users registered.")
             return
         
         # User selection
-        selected_user = st.selectbox(
+        selected_employee_id = st.selectbox(
             "Select User for Detailed Analysis:",
-            options=users,
-            format_func=lambda x: f"{x[1]} ({x[2]})"  # name (employee_id)
+            options=list(user_labels),
+            format_func=user_labels.get  # name (employee_id)
         )
         
-        if not selected_user:
+        if not selected_employee_id:
             return
         
-        user_id, user_name, employee_id, email, department, image_path, created_at = selected_user
+        user_id, user_name, employee_id, email, department, image_path, created_at = users_by_id[selected_employee_id]
         
-        # Filter records for selected user
-        user_records = [record for record in records if record[2] == employee_id]
-        
-        if not user_records:
+        if employee_id not in per_user.index:
             st.info(f"No attendance records found for {user_name}.")
             return
         
+        stats = per_user.loc[employee_id]
+        
         # User information
         col1, col2 = st.columns(2)
         
@@ -294,23 +365,15 @@ class ReportsPage:
             st.write(f"**Email:** {email or 'N/A'}")
         
         with col2:
-            st.write(f"**Total Attendance Days:** {len(user_records)}")
-            avg_confidence = sum(record[7] for record in user_records if record[7]) / len(user_records)
-            st.write(f"**Average Confidence:** {avg_confidence:.2f}")
+            st.write(f"**Total Attendance Days:** {int(stats['days'])}")
+            st.write(f"**Average Confidence:** {stats['avg_confidence']:.2f}")
             
             # Check-in/out stats
-            check_ins = sum(1 for record in user_records if record[4])
-            check_outs = sum(1 for record in user_records if record[5])
-            st.write(f"**Check-ins:** {check_ins}")
-            st.write(f"**Check-outs:** {check_outs}")
-        
-        # User attendance timeline
-        user_df = pd.DataFrame(user_records, columns=[
-            'id', 'name', 'employee_id', 'department', 'check_in_time', 
-            'check_out_time', 'date', 'confidence'
-        ])
-        
-        user_df['date'] = pd.to_datetime(user_df['date'])
+            st.write(f"**Check-ins:** {int(stats['check_ins'])}")
+            st.write(f"**Check-outs:** {int(stats['check_outs'])}")
+        
+        # User attendance timeline; only the plot and recent rows need the raw records
+        user_df = df[df['employee_id'] == employee_id]
         user_attendance = user_df.groupby('date').size().reset_index(name='count')
         
         fig_user = px.scatter(
@@ -334,14 +397,11 @@ class ReportsPage:
         # Recent attendance records
         st.write("**Recent Attendance Records:**")
         recent_records = user_df.tail(10).copy()
-        recent_records['Check In'] = pd.to_datetime(recent_records['check_in_time']).dt.strftime('%H:%M:%S')
-        recent_records['Check Out'] = pd.to_datetime(recent_records['check_out_time']).dt.strftime('%H:%M:%S')
+        check_in, check_out = recent_records['check_in_time'], recent_records['check_out_time']
+        recent_records['Check In'] = check_in.dt.strftime('%H:%M:%S').mask(check_in.isna(), 'Not checked in')
+        recent_records['Check Out'] = check_out.dt.strftime('%H:%M:%S').mask(check_out.isna(), 'Not checked out')
         recent_records['Date'] = recent_records['date'].dt.strftime('%Y-%m-%d')
         
-        display_cols = ['Date', 'Check In', 'Check Out', 'confidence']
-        recent_records['Check In'] = recent_records['Check In'].replace('NaT', 'Not checked in')
-        recent_records['Check Out'] = recent_records['Check Out'].replace('NaT', 'Not checked out')
-        
         st.dataframe(
             recent_records[['Date', 'Check In', 'Check Out', 'confidence']].rename(columns={'confidence': 'Confidence'}),
             use_container_width=True
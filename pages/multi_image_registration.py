@@ -4,9 +4,15 @@ import numpy as np
 from streamlit_webrtc import webrtc_streamer, VideoTransformerBase, RTCConfiguration
 import av
 import time
-from database.db_manager import DatabaseManager
-from face_detection.face_detector import FaceDetector
+import threading
+import logging
+from collections import deque
+from types import MappingProxyType
+import face_recognition as fr
+from face_detection.face_detector import USE_OPENCL
 from face_detection.anti_spoofing import LivenessDetector
+from face_detection._overlay import blit_text
+from utils.resources import get_db_manager, get_face_detector, invalidate_user_caches
 from datetime import datetime
 import os
 import tempfile
@@ -16,96 +22,224 @@ RTC_CONFIGURATION = RTCConfiguration({
     "iceServers": [{"urls": ["stun:stun.l.google.com:19302"]}]
 })
 
+# Detect faces on every Nth analysed frame; liveness still sees every frame so short blinks are caught
+DETECTION_INTERVAL = 3
+
+# Detect on a quarter-size frame; crops are still taken from the full-resolution frame
+DETECTION_SCALE = 0.25
+
+# Side length of the capture thumbnails drawn in the preview
+THUMB_SIZE = 60
+
+# Standard face crop size used for encoding at registration time
+FACE_SIZE = 150
+
 class MultiImageRegistrationTransformer(VideoTransformerBase):
     def __init__(self):
-        self.face_detector = FaceDetector()
+        self.face_detector = get_face_detector()
+        # Liveness keeps per-viewer blink state, so each session owns one
         self.liveness_detector = LivenessDetector()
-        self.captured_images = []
         self.max_images = 5
+        self._clear_captures()
         self.capture_interval = 2  # seconds between captures
         self.last_capture_time = 0
         self.registration_complete = False
         
+        # Results of the last analysed frame, redrawn on every frame until the next one lands;
+        # frame_counter counts analysed frames and decides when detection runs
+        self.frame_counter = 0
+        self.last_detections = []
+        self.last_liveness = (False, False, "Position face in frame for liveness check")
+        
+        # Detection and liveness run on a worker thread fed with the newest frame only;
+        # _lock guards the results and captures shared with recv and the Streamlit thread
+        self._lock = threading.Lock()
+        self._pending = deque(maxlen=1)
+        self._pending_cv = threading.Condition()
+        self._stop_event = threading.Event()
+        self._worker = None
+        
     def set_user_info(self, name, department, role):
         """Set user information for registration"""
         self.user_name = name
         self.user_department = department
         self.user_role = role
         
+    def _clear_captures(self):
+        """Captures are kept as parallel per-field arrays, filled up to _count"""
+        self._images = [None] * self.max_images
+        self._thumbs = [None] * self.max_images
+        self._face_boxes = [None] * self.max_images
+        self._timestamps = [None] * self.max_images
+        self._ts_strs = [None] * self.max_images
+        self._confidences = np.zeros(self.max_images, dtype=np.float32)
+        self._count = 0
+        
     def reset_capture(self):
         """Reset capture state for new registration"""
-        self.captured_images = []
-        self.last_capture_time = 0
-        self.registration_complete = False
+        with self._lock:
+            self._clear_captures()
+            self.last_capture_time = 0
+            self.registration_complete = False
         
     def recv(self, frame):
         img = frame.to_ndarray(format="bgr24")
-        current_time = time.time()
+        self._ensure_worker()
         
-        # Detect faces
-        detected_faces = self.face_detector.detect_faces_in_frame(img)
+        # Hand the frame to the worker; a frame still waiting from before is evicted
+        # so the worker always picks up the newest one when it frees up
+        with self._pending_cv:
+            self._pending.append(img.copy())
+            self._pending_cv.notify()
         
-        # Process liveness detection
-        is_live, detection_complete, status_message, processed_frame = self.liveness_detector.process_frame(img)
+        # Draw interface from the latest analysis result
+        with self._lock:
+            is_live, detection_complete, status_message = self.last_liveness
+            processed_frame = self._draw_registration_interface(img, self.last_detections,
+                                                              is_live, detection_complete, status_message)
         
-        # Auto-capture logic
-        if (detected_faces and len(detected_faces) > 0 and 
-            is_live and detection_complete and 
-            len(self.captured_images) < self.max_images and
-            current_time - self.last_capture_time > self.capture_interval):
+        # PyAV needs a C-contiguous array; copy only when the overlay produced a strided view
+        if not processed_frame.flags['C_CONTIGUOUS']:
+            processed_frame = np.ascontiguousarray(processed_frame)
+        
+        return av.VideoFrame.from_ndarray(processed_frame, format="bgr24")
+    
+    def on_ended(self):
+        """Stop the analysis thread when the WebRTC stream ends"""
+        self._stop_event.set()
+    
+    def _ensure_worker(self):
+        """Start the analysis thread, or restart it after an earlier stream ended"""
+        if self._worker is None or not self._worker.is_alive():
+            self._stop_event.clear()
+            self._worker = threading.Thread(target=self._analysis_loop, daemon=True)
+            self._worker.start()
+    
+    def _analysis_loop(self):
+        """Analyse queued frames until the stream ends"""
+        while not self._stop_event.is_set():
+            with self._pending_cv:
+                if not self._pending:
+                    self._pending_cv.wait(timeout=0.5)
+                if not self._pending:
+                    continue
+                img = self._pending.popleft()
             
-            # Capture face image
-            face_img = self._extract_face_image(img, detected_faces[0])
-            if face_img is not None:
-                self.captured_images.append({
-                    'image': face_img,
-                    'timestamp': datetime.now(),
-                    'confidence': detected_faces[0][1] if len(detected_faces[0]) > 1 else 0.8
-                })
-                self.last_capture_time = current_time
-                
-                # Check if registration is complete
-                if len(self.captured_images) >= self.max_images:
-                    self.registration_complete = True
+            try:
+                self._analyse_frame(img)
+            except Exception as e:
+                logging.error(f"Error analysing registration frame: {e}")
+    
+    def _analyse_frame(self, img):
+        """Run liveness on one frame, detection on every Nth, and auto-capture the face when ready"""
+        fresh_detection = self.frame_counter % DETECTION_INTERVAL == 0
+        self.frame_counter += 1
         
-        # Draw interface
-        processed_frame = self._draw_registration_interface(processed_frame, detected_faces, 
-                                                          is_live, detection_complete, status_message)
+        if fresh_detection:
+            # Detect faces on a downscaled copy and scale the boxes back up. Registration only
+            # needs locations (the person is not enrolled yet), so no encoding/matching is done here.
+            # Each box carries its size/sharpness quality in the confidence slot
+            small = cv2.resize(img, (0, 0), fx=DETECTION_SCALE, fy=DETECTION_SCALE, interpolation=cv2.INTER_AREA)
+            boxes = [tuple(int(coord / DETECTION_SCALE) for coord in box)
+                     for box in self.face_detector.detect_once(small)]
+            detected_faces = [(None, self.face_detector.face_quality_score(img, box), box, None)
+                              for box in boxes]
+        else:
+            with self._lock:
+                detected_faces = self.last_detections
         
-        return av.VideoFrame.from_ndarray(processed_frame, format="bgr24")
+        # Liveness counts consecutive closed-eye frames, so it must see every frame. This copy is
+        # discarded, so skip the annotations; recv draws status_message on the live frame instead
+        is_live, detection_complete, status_message, _ = self.liveness_detector.process_frame(img, draw=False)
+        current_time = time.time()
+        
+        with self._lock:
+            self.last_detections = detected_faces
+            self.last_liveness = (is_live, detection_complete, status_message)
+            
+            # Auto-capture logic, only on freshly detected frames so boxes are never stale
+            if (fresh_detection and detected_faces and len(detected_faces) > 0 and 
+                is_live and detection_complete and 
+                self._count < self.max_images and
+                current_time - self.last_capture_time > self.capture_interval):
+                
+                # Capture face image
+                face_img, face_box = self._extract_face_image(img, detected_faces[0])
+                if face_img is not None:
+                    i = self._count
+                    timestamp = datetime.now()
+                    self._images[i] = face_img
+                    self._face_boxes[i] = face_box
+                    self._timestamps[i] = timestamp
+                    self._confidences[i] = detected_faces[0][1]
+                    
+                    # Preview thumbnail and label never change, so build them once here
+                    self._thumbs[i] = cv2.resize(face_img, (THUMB_SIZE, THUMB_SIZE), interpolation=cv2.INTER_AREA)
+                    self._ts_strs[i] = timestamp.strftime("%H:%M:%S")
+                    
+                    self._count += 1
+                    self.last_capture_time = current_time
+                    
+                    # Check if registration is complete
+                    if self._count >= self.max_images:
+                        self.registration_complete = True
     
     def _extract_face_image(self, frame, face_info):
-        """Extract face region from frame"""
-        try:
-            name, confidence, location, user_id = face_info
-            if location:
-                top, right, bottom, left = location
-                
-                # Add padding around face
-                padding = 20
-                h, w = frame.shape[:2]
-                top = max(0, top - padding)
-                bottom = min(h, bottom + padding)
-                left = max(0, left - padding)
-                right = min(w, right + padding)
-                
-                face_img = frame[top:bottom, left:right]
-                
-                # Resize to standard size
-                if face_img.size > 0:
-                    face_img = cv2.resize(face_img, (150, 150))
-                    return face_img
-        except:
-            pass
-        return None
+        """
+        Extract face region from frame
+        Returns:
+            (face crop, face location relative to the crop), or (None, None) if there is no usable face
+        """
+        if not face_info or len(face_info) < 4:
+            return None, None
+        
+        name, confidence, location, user_id = face_info
+        if not location or len(location) != 4:
+            return None, None
+        
+        top, right, bottom, left = location
+        
+        # Add padding around face
+        padding = 20
+        h, w = frame.shape[:2]
+        crop_top = max(0, top - padding)
+        crop_bottom = min(h, bottom + padding)
+        crop_left = max(0, left - padding)
+        crop_right = min(w, right + padding)
+        
+        # Kept at full resolution; resizing is deferred to registration time. Copied once
+        # into its own buffer, never a view, so the parent frame is not kept alive.
+        face_img = frame[crop_top:crop_bottom, crop_left:crop_right]
+        
+        if face_img.size == 0:
+            return None, None
+        
+        # The detected box in crop coordinates, so encoding can skip detection without losing alignment
+        face_box = (max(top, crop_top) - crop_top, min(right, crop_right) - crop_left,
+                    min(bottom, crop_bottom) - crop_top, max(left, crop_left) - crop_left)
+        return face_img.copy(), face_box
     
     def _draw_registration_interface(self, frame, detected_faces, is_live, detection_complete, status_message):
         """Draw registration interface on frame"""
         h, w = frame.shape[:2]
         
+        # Place the captured thumbnails first; they are plain array copies
+        thumb_size = THUMB_SIZE
+        spacing = 70
+        start_x = w - (self.max_images * spacing)
+        y = 10
+        thumb_xs = [start_x + (i * spacing) for i in range(self._count)
+                    if start_x + (i * spacing) + thumb_size <= w and y + thumb_size <= h]
+        
+        for i, x in enumerate(thumb_xs):
+            frame[y:y+thumb_size, x:x+thumb_size] = self._thumbs[i]
+        
+        # Run the cv2 text/box drawing on the OpenCL device when enabled and download once
+        overlay = cv2.UMat(frame) if USE_OPENCL else frame
+        
         # Draw status
         status_color = (0, 255, 0) if is_live and detection_complete else (0, 255, 255)
-        cv2.putText(frame, status_message, (10, 30),
+        cv2.putText(overlay, status_message, (10, 30),
                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, status_color, 2)
         
         # Draw face detection
@@ -116,35 +250,45 @@ class MultiImageRegistrationTransformer(VideoTransformerBase):
                 
                 # Draw face rectangle
                 color = (0, 255, 0) if is_live and detection_complete else (0, 255, 255)
-                cv2.rectangle(frame, (left, top), (right, bottom), color, 2)
+                cv2.rectangle(overlay, (left, top), (right, bottom), color, 2)
                 
                 # Draw confidence
                 if confidence > 0:
-                    cv2.putText(frame, f"Quality: {confidence:.2f}", (left, top - 10),
+                    cv2.putText(overlay, f"Quality: {confidence:.2f}", (left, top - 10),
                                cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
         
-        # Draw capture progress
-        progress_text = f"Captured: {len(self.captured_images)}/{self.max_images}"
-        cv2.putText(frame, progress_text, (10, 60),
-                   cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+        for i, x in enumerate(thumb_xs):
+            # Draw border
+            cv2.rectangle(overlay, (x, y), (x+thumb_size, y+thumb_size), (0, 255, 0), 2)
+            
+            # Draw timestamp
+            cv2.putText(overlay, self._ts_strs[i], (x, y+thumb_size+15),
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.3, (255, 255, 255), 1)
+        
+        if USE_OPENCL:
+            frame = overlay.get()
         
-        # Draw progress bar
+        # Draw capture progress; the few possible labels are rasterized once and reused
+        progress_text = f"Captured: {self._count}/{self.max_images}"
+        blit_text(frame, progress_text, (10, 60), (255, 255, 255))
+        
+        # Draw progress bar as plain slice fills
         bar_width = 300
         bar_height = 20
         bar_x = 10
         bar_y = 80
         
         # Background
-        cv2.rectangle(frame, (bar_x, bar_y), (bar_x + bar_width, bar_y + bar_height), (50, 50, 50), -1)
+        frame[bar_y:bar_y + bar_height + 1, bar_x:bar_x + bar_width + 1] = (50, 50, 50)
         
         # Progress
-        progress = len(self.captured_images) / self.max_images
+        progress = self._count / self.max_images
         progress_width = int(bar_width * progress)
         if progress_width > 0:
-            cv2.rectangle(frame, (bar_x, bar_y), (bar_x + progress_width, bar_y + bar_height), (0, 255, 0), -1)
+            frame[bar_y:bar_y + bar_height + 1, bar_x:bar_x + progress_width + 1] = (0, 255, 0)
         
         # Instructions
-        if len(self.captured_images) < self.max_images:
+        if self._count < self.max_images:
             if is_live and detection_complete and detected_faces and len(detected_faces) > 0:
                 instruction = "Look at camera - Auto capturing..."
                 color = (0, 255, 0)
@@ -155,47 +299,39 @@ class MultiImageRegistrationTransformer(VideoTransformerBase):
             instruction = "Registration Complete! Click 'Complete Registration'"
             color = (0, 255, 0)
             
-        cv2.putText(frame, instruction, (10, h - 30),
-                   cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
-        
-        # Show captured images as thumbnails
-        thumb_size = 60
-        spacing = 70
-        start_x = w - (self.max_images * spacing)
-        
-        for i, img_data in enumerate(self.captured_images):
-            x = start_x + (i * spacing)
-            y = 10
-            
-            # Resize thumbnail
-            thumb = cv2.resize(img_data['image'], (thumb_size, thumb_size))
-            
-            # Place thumbnail
-            if x + thumb_size <= w and y + thumb_size <= h:
-                frame[y:y+thumb_size, x:x+thumb_size] = thumb
-                
-                # Draw border
-                cv2.rectangle(frame, (x, y), (x+thumb_size, y+thumb_size), (0, 255, 0), 2)
-                
-                # Draw timestamp
-                timestamp = img_data['timestamp'].strftime("%H:%M:%S")
-                cv2.putText(frame, timestamp, (x, y+thumb_size+15),
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.3, (255, 255, 255), 1)
+        blit_text(frame, instruction, (10, h - 30), color)
         
         return frame
     
     def get_captured_images(self):
-        """Get all captured images"""
-        return self.captured_images
+        """Get all captured images as read-only views; the image arrays are shared, not copied"""
+        with self._lock:
+            return [
+                MappingProxyType({'image': self._images[i], 'face_box': self._face_boxes[i],
+                                  'timestamp': self._timestamps[i],
+                                  'confidence': float(self._confidences[i])})
+                for i in range(self._count)
+            ]
+    
+    def get_capture_count(self):
+        """Number of images captured so far"""
+        with self._lock:
+            return self._count
+    
+    def get_average_quality(self):
+        """Mean capture quality (face size and sharpness), 0.0 before the first capture"""
+        with self._lock:
+            return float(self._confidences[:self._count].mean()) if self._count else 0.0
     
     def is_registration_complete(self):
         """Check if registration is complete"""
-        return self.registration_complete
+        with self._lock:
+            return self.registration_complete
 
 class MultiImageRegistrationPage:
     def __init__(self):
-        self.db_manager = DatabaseManager()
-        self.face_detector = FaceDetector()
+        self.db_manager = get_db_manager()
+        self.face_detector = get_face_detector()
         
     def render(self):
         st.title("👥 Multi-Image User Registration")
@@ -285,17 +421,13 @@ class MultiImageRegistrationPage:
         
         if webrtc_ctx.video_transformer:
             transformer = webrtc_ctx.video_transformer
-            captured_count = len(transformer.get_captured_images())
+            captured_count = transformer.get_capture_count()
             
             with col1:
                 st.metric("Images Captured", f"{captured_count}/5")
             
             with col2:
-                if captured_count > 0:
-                    avg_quality = np.mean([img['confidence'] for img in transformer.get_captured_images()])
-                    st.metric("Average Quality", f"{avg_quality:.2f}")
-                else:
-                    st.metric("Average Quality", "0.00")
+                st.metric("Average Quality", f"{transformer.get_average_quality():.2f}")
             
             with col3:
                 if transformer.is_registration_complete():
@@ -330,21 +462,27 @@ class MultiImageRegistrationPage:
         """Complete the registration process with multiple images"""
         try:
             with st.spinner("Processing registration..."):
-                # Extract face encodings from all captured images
+                # Extract face encodings from all captured images. Each capture is a padded face crop
+                # stored with its detected box, so detection is skipped and the box is scaled along.
                 face_encodings = []
                 
+                # Resize the full-resolution crops to the standard size, then flip the whole stack
+                # to RGB with a channel-reversed view made contiguous once for dlib
+                faces = np.stack([cv2.resize(img_data['image'], (FACE_SIZE, FACE_SIZE)) for img_data in captured_images])
+                rgb_faces = np.ascontiguousarray(faces[..., ::-1])
+                
+                face_locations = []
                 for img_data in captured_images:
-                    img = img_data['image']
-                    # Convert to RGB for face_recognition
-                    rgb_img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-                    
-                    # Get face encoding
-                    import face_recognition
-                    face_locations = face_recognition.face_locations(rgb_img)
-                    if face_locations:
-                        encodings = face_recognition.face_encodings(rgb_img, face_locations)
-                        if encodings:
-                            face_encodings.append(encodings[0])
+                    crop_h, crop_w = img_data['image'].shape[:2]
+                    top, right, bottom, left = img_data['face_box']
+                    scale_y, scale_x = FACE_SIZE / crop_h, FACE_SIZE / crop_w
+                    face_locations.append((int(top * scale_y), int(right * scale_x),
+                                           int(bottom * scale_y), int(left * scale_x)))
+                
+                # The 5-point landmark model is enough to align an already-located face
+                for rgb_img, face_location in zip(rgb_faces, face_locations):
+                    face_encodings.extend(fr.face_encodings(rgb_img, known_face_locations=[face_location],
+                                                            num_jitters=1, model="small"))
                 
                 if not face_encodings:
                     st.error("❌ Could not extract face encodings from captured images!")
@@ -361,6 +499,7 @@ class MultiImageRegistrationPage:
                 )
                 
                 if success:
+                    invalidate_user_caches()
                     st.success(f"✅ Successfully registered {user_info['name']} with {len(face_encodings)} face encodings!")
                     st.balloons()
                     
@@ -1,15 +1,32 @@
 import os
 import cv2
 import numpy as np
+import atexit
+import threading
 from datetime import datetime
 import streamlit as st
 
+# Attendance log writer kept open for the current day and flushed in batches
+LOG_FLUSH_EVERY = 50
+_LOG_LOCK = threading.Lock()
+_LOG_HANDLE = None
+_LOG_DATE = None
+_LOG_PENDING = 0
+
+# Directories known to exist, so repeated saves and log writes skip the stat call
+_ENSURED_DIRS = set()
+
 def ensure_directory_exists(directory_path):
     """Ensure directory exists, create if it doesn't"""
-    if not os.path.exists(directory_path):
-        os.makedirs(directory_path)
-        return True
-    return False
+    # Directories already seen this process are trusted without another stat
+    if directory_path in _ENSURED_DIRS:
+        return False
+    
+    created = not os.path.exists(directory_path)
+    if created:
+        os.makedirs(directory_path, exist_ok=True)
+    _ENSURED_DIRS.add(directory_path)
+    return created
 
 def save_image(image, filename, directory="data/temp"):
     """Save image to specified directory"""
@@ -23,8 +40,8 @@ def get_timestamp_filename(prefix="img", extension=".jpg"):
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     return f"{prefix}_{timestamp}{extension}"
 
-def resize_image(image, max_width=800, max_height=600):
-    """Resize image while maintaining aspect ratio"""
+def resize_image(image, max_width=800, max_height=600, dst=None):
+    """Resize image while maintaining aspect ratio, optionally into a reusable dst buffer"""
     height, width = image.shape[:2]
     
     # Calculate scaling factor
@@ -36,7 +53,15 @@ def resize_image(image, max_width=800, max_height=600):
     if scale < 1:
         new_width = int(width * scale)
         new_height = int(height * scale)
-        resized = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_AREA)
+        
+        # INTER_AREA only pays off for large shrinks; INTER_LINEAR is faster and equivalent for mild ones
+        interpolation = cv2.INTER_AREA if scale < 0.5 else cv2.INTER_LINEAR
+        
+        # Ignore a caller buffer that does not match the output size
+        if dst is not None and dst.shape[:2] != (new_height, new_width):
+            dst = None
+        
+        resized = cv2.resize(image, (new_width, new_height), dst=dst, interpolation=interpolation)
         return resized
     
     return image
@@ -146,50 +171,66 @@ def create_face_grid(face_images, grid_size=(3, 3), cell_size=(150, 150)):
     rows, cols = grid_size
     cell_width, cell_height = cell_size
     
-    # Create grid image
-    grid_width = cols * cell_width
-    grid_height = rows * cell_height
-    grid_image = np.zeros((grid_height, grid_width, 3), dtype=np.uint8)
+    # One cell per grid slot; slots without a face stay black
+    cells = np.zeros((rows * cols, cell_height, cell_width, 3), dtype=np.uint8)
+    faces = [cv2.resize(face_image, cell_size) for face_image in face_images[:rows * cols]]
     
-    for i, face_image in enumerate(face_images[:rows * cols]):
-        row = i // cols
-        col = i % cols
+    if faces:
+        filled = cells[:len(faces)]
+        filled[:] = np.stack(faces)
         
-        # Resize face image
-        face_resized = cv2.resize(face_image, cell_size)
-        
-        # Calculate position in grid
-        y_start = row * cell_height
-        y_end = y_start + cell_height
-        x_start = col * cell_width
-        x_end = x_start + cell_width
-        
-        # Place image in grid
-        grid_image[y_start:y_end, x_start:x_end] = face_resized
-        
-        # Add border
-        cv2.rectangle(grid_image, (x_start, y_start), (x_end-1, y_end-1), (255, 255, 255), 2)
-    
-    return grid_image
+        # Add border to every filled cell, one assignment per edge
+        filled[:, :2] = 255
+        filled[:, -2:] = 255
+        filled[:, :, :2] = 255
+        filled[:, :, -2:] = 255
+    
+    # Tile (rows*cols, H, W, 3) into (rows*H, cols*W, 3)
+    grid_image = cells.reshape(rows, cols, cell_height, cell_width, 3).transpose(0, 2, 1, 3, 4)
+    return grid_image.reshape(rows * cell_height, cols * cell_width, 3)
 
 def log_attendance_event(user_name, employee_id, action, confidence=None):
     """Log attendance events for debugging"""
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    global _LOG_HANDLE, _LOG_DATE, _LOG_PENDING
+    
+    now = datetime.now()
+    timestamp = now.strftime("%Y-%m-%d %H:%M:%S")
     confidence_str = f" (confidence: {confidence:.2f})" if confidence else ""
     
     log_message = f"[{timestamp}] {action.upper()}: {user_name} ({employee_id}){confidence_str}"
     
-    # Write to log file
-    log_dir = "data/logs"
-    ensure_directory_exists(log_dir)
-    
-    log_file = os.path.join(log_dir, f"attendance_{datetime.now().strftime('%Y%m%d')}.log")
-    
-    with open(log_file, "a", encoding="utf-8") as f:
-        f.write(log_message + "\n")
+    # Write to log file, reopening only when the day rolls over
+    with _LOG_LOCK:
+        today = now.strftime('%Y%m%d')
+        if _LOG_HANDLE is None or _LOG_DATE != today:
+            if _LOG_HANDLE is not None:
+                _LOG_HANDLE.close()
+            
+            log_dir = "data/logs"
+            ensure_directory_exists(log_dir)
+            
+            log_file = os.path.join(log_dir, f"attendance_{today}.log")
+            _LOG_HANDLE = open(log_file, "a", encoding="utf-8", buffering=8192)
+            _LOG_DATE = today
+            _LOG_PENDING = 0
+        
+        _LOG_HANDLE.write(log_message + "\n")
+        _LOG_PENDING += 1
+        if _LOG_PENDING >= LOG_FLUSH_EVERY:
+            _LOG_HANDLE.flush()
+            _LOG_PENDING = 0
     
     return log_message
 
+@atexit.register
+def _close_attendance_log():
+    """Flush and close the attendance log on interpreter shutdown"""
+    global _LOG_HANDLE
+    with _LOG_LOCK:
+        if _LOG_HANDLE is not None:
+            _LOG_HANDLE.close()
+            _LOG_HANDLE = None
+
 def get_system_info():
     """Get system information for debugging"""
     import platform
@@ -213,18 +254,15 @@ def cleanup_old_files(directory, days_old=30):
     cutoff_time = datetime.now().timestamp() - (days_old * 24 * 60 * 60)
     deleted_count = 0
     
-    for filename in os.listdir(directory):
-        filepath = os.path.join(directory, filename)
-        
-        if os.path.isfile(filepath):
-            file_time = os.path.getmtime(filepath)
-            
-            if file_time < cutoff_time:
+    # DirEntry caches the file type and stat result from the directory scan
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.stat().st_mtime < cutoff_time:
                 try:
-                    os.remove(filepath)
+                    os.remove(entry.path)
                     deleted_count += 1
                 except Exception as e:
-                    print(f"Error deleting {filepath}: {e}")
+                    print(f"Error deleting {entry.path}: {e}")
     
     return deleted_count
 
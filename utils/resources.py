@@ -0,0 +1,90 @@
+"""
+Shared Resources
+
+Process-wide database manager and face detector used by every page and
+WebRTC session. Plain lru_cache singletons are used rather than
+st.cache_resource so they can also be reached from WebRTC worker threads.
+"""
+
+import functools
+import threading
+from database.db_manager import DatabaseManager
+from face_detection.face_detector import FaceDetector
+from face_detection.face_encoder import FaceEncoder
+
+# Guards first construction so concurrent sessions never build two instances
+_CREATE_LOCK = threading.Lock()
+
+# Serialises known-face reloads of the shared detector
+_RELOAD_LOCK = threading.Lock()
+
+# Modification time of the encoding cache the shared detector was last loaded from
+_UNLOADED = object()
+_loaded_cache_mtime = _UNLOADED
+
+# Cached user-list loaders registered by the pages that own them
+_USER_CACHES = []
+
+@functools.lru_cache(maxsize=1)
+def _create_db_manager():
+    return DatabaseManager()
+
+@functools.lru_cache(maxsize=1)
+def _create_face_detector():
+    return FaceDetector()
+
+@functools.lru_cache(maxsize=1)
+def _create_face_encoder():
+    return FaceEncoder()
+
+def get_db_manager() -> DatabaseManager:
+    """Process-wide database manager"""
+    with _CREATE_LOCK:
+        return _create_db_manager()
+
+def get_face_detector() -> FaceDetector:
+    """Process-wide face detector, known faces are loaded by get_recognition_detector"""
+    with _CREATE_LOCK:
+        return _create_face_detector()
+
+def get_recognition_detector() -> FaceDetector:
+    """Process-wide face detector with the known faces, reloaded whenever the encoding cache is rewritten"""
+    global _loaded_cache_mtime
+    face_detector = get_face_detector()
+    with _CREATE_LOCK:
+        encoder = _create_face_encoder()
+    
+    if encoder.encoding_cache_mtime() == _loaded_cache_mtime:
+        return face_detector
+    
+    with _RELOAD_LOCK:
+        mtime = encoder.encoding_cache_mtime()
+        if mtime == _loaded_cache_mtime:
+            return face_detector
+        
+        # Prefer the precomputed encoding matrix; fall back to the database
+        cache = encoder.load_encoding_cache() if mtime is not None else None
+        if cache is not None:
+            face_detector.load_known_face_matrix(cache['ids'], cache['names'], cache['encodings'])
+        else:
+            face_detector.load_known_faces(get_db_manager().get_user_face_encodings())
+        _loaded_cache_mtime = mtime
+    return face_detector
+
+def user_cache(cached_func):
+    """Register an st.cache_data user-list loader so invalidate_user_caches clears it"""
+    _USER_CACHES.append(cached_func)
+    return cached_func
+
+def invalidate_user_caches() -> bool:
+    """
+    Clear every cached user list and rewrite the encoding cache after a user is added or deleted
+    Returns:
+        bool: True if the encoding cache was rewritten
+    """
+    for cached_func in _USER_CACHES:
+        cached_func.clear()
+    
+    with _CREATE_LOCK:
+        encoder = _create_face_encoder()
+    return encoder.save_encoding_cache(get_db_manager().get_user_face_encodings())